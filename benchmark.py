@@ -0,0 +1,243 @@
+#   Benchmark and round-trip checks for fcb1010 sysex codec and file handling
+#
+#   Checks that randomised configurations survive conversion to sysex, CSV and .syx files then measures
+#   throughput (operations per second) and memory allocated per operation of the main functions.
+#   Results may be stored as a baseline. Later runs fail if throughput drops below the baseline by more than
+#   the threshold.
+#
+#   Usage: python benchmark.py [--save-baseline] [--baseline FILE] [--threshold FRACTION] [--rounds N]
+#   Exit status is 0 on success, 1 if a round-trip check fails or throughput regresses
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from fcb1010 import fcb1010, _PRESET_DEFAULTS, _FLAG_FIELDS, _GLOBAL_CHANNELS, _GLOBAL_SWITCHES, _GLOBAL_CALIBRATION
+
+
+#   Populate a configuration with random values
+#   config: fcb1010 object
+#   rng: random.Random object
+#   returns: config
+def randomise(config, rng):
+    for preset in config.preset:
+        for field in _PRESET_DEFAULTS:
+            if field in _FLAG_FIELDS:
+                setattr(preset, field, rng.random() < 0.5)
+            else:
+                setattr(preset, field, rng.randrange(128))
+    for name, offset, duplicate in _GLOBAL_CHANNELS:
+        setattr(config, name, rng.randrange(16))
+    for name, offset, mask in _GLOBAL_SWITCHES:
+        setattr(config, name, rng.random() < 0.5)
+    for name, offset in _GLOBAL_CALIBRATION:
+        setattr(config, name, rng.randrange(128))
+    return config
+
+
+#   Compare two configurations field by field using attribute access only
+#   expected: fcb1010 object
+#   actual: fcb1010 object
+#   globals: Iterable of global attribute names to compare
+#   returns: List of descriptions of mismatched fields
+def compare(expected, actual, globals):
+    errors = []
+    for index, (preset, other) in enumerate(zip(expected.preset, actual.preset)):
+        for field in _PRESET_DEFAULTS:
+            if getattr(preset, field) != getattr(other, field):
+                errors.append("preset %d %s: %r != %r" % (index, field, getattr(preset, field), getattr(other, field)))
+    for name in globals:
+        if getattr(expected, name) != getattr(actual, name):
+            errors.append("%s: %r != %r" % (name, getattr(expected, name), getattr(actual, name)))
+    return errors
+
+
+#   Run round-trip checks on randomised configurations
+#   rounds: Quantity of random configurations to check
+#   seed: Random seed
+#   returns: List of failure descriptions
+def check_round_trips(rounds, seed=1010):
+    all_globals = [name for name, *layout in _GLOBAL_CHANNELS + _GLOBAL_SWITCHES + _GLOBAL_CALIBRATION]
+    channels = [name for name, *layout in _GLOBAL_CHANNELS]
+    failures = []
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as folder:
+        for round in range(rounds):
+            config = randomise(fcb1010(), rng)
+            raw = config.get_raw_sysex()
+
+            decoded = fcb1010()
+            if not decoded.parse_sysex(list(raw)):
+                failures.append("round %d: sysex rejected" % round)
+                continue
+            failures += ["round %d sysex: %s" % (round, error) for error in compare(config, decoded, all_globals)]
+            if decoded.get_raw_sysex() != raw:
+                failures.append("round %d: sysex not stable when re-encoded" % round)
+
+            lazy = fcb1010()
+            lazy.parse_sysex(memoryview(bytes(raw)), lazy=True)
+            failures += ["round %d lazy: %s" % (round, error) for error in compare(config, lazy, all_globals)]
+
+            # Incremental encoding must match a full encode
+            edited = fcb1010()
+            edited.parse_sysex(raw)
+            edited.get_raw_sysex()
+            edited.set_param('expA_max', rng.randrange(128), bank=rng.randrange(10))
+            preset = edited.preset[rng.randrange(100)]
+            preset.cc2_value = rng.randrange(128)
+            preset.note_enabled = not preset.note_enabled
+            edited.merge = not edited.merge
+            incremental = edited.get_raw_sysex()
+            edited.invalidate()
+            if incremental != edited.get_raw_sysex():
+                failures.append("round %d: incremental encode differs from full encode" % round)
+
+            text = io.StringIO()
+            config.save(text)
+            from_csv = fcb1010()
+            if not from_csv.load(io.StringIO(text.getvalue())):
+                failures.append("round %d: CSV rejected" % round)
+            else:
+                failures += ["round %d CSV: %s" % (round, error) for error in compare(config, from_csv, channels)]
+
+            filename = os.path.join(folder, 'round.syx')
+            config.save_syx(filename)
+            from_syx = fcb1010()
+            if not from_syx.load_syx(filename):
+                failures.append("round %d: .syx rejected" % round)
+            else:
+                failures += ["round %d .syx: %s" % (round, error) for error in compare(config, from_syx, all_globals)]
+    return failures
+
+
+#   Measure throughput and allocations of a function
+#   func: Function to call without arguments
+#   duration: Minimum time in seconds to run each of the repeats
+#   repeats: Quantity of timing runs, best is reported
+#   returns: Tuple (operations per second, bytes allocated per operation)
+def measure(func, duration=0.2, repeats=3):
+    count = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(count):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration / 10:
+            break
+        count *= 2
+    count = max(1, int(count * duration / elapsed))
+    best = float('inf')
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        for i in range(count):
+            func()
+        best = min(best, (time.perf_counter() - start) / count)
+    tracemalloc.start()
+    func()
+    allocated = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (1 / best, allocated)
+
+
+#   Run benchmarks
+#   returns: Dictionary of benchmark name: (operations per second, bytes allocated per operation)
+def run_benchmarks():
+    rng = random.Random(2021)
+    default = fcb1010()
+    config = randomise(fcb1010(), rng)
+    raw = bytes(config.get_raw_sysex())
+    raw_list = list(raw)
+    text = io.StringIO()
+    config.save(text)
+    csv_text = text.getvalue()
+    target = fcb1010()
+    buffer = bytearray(len(raw))
+
+    def encode_full():
+        config.invalidate()
+        config.get_raw_sysex(buffer)
+
+    def encode_edit():
+        config.preset[42].cc1_value ^= 1
+        config.get_raw_sysex(buffer)
+
+    def edit_find():
+        config.preset[42].cc1_controller ^= 1
+        config.find('cc1', config.preset[42].cc1_controller)
+
+    history = randomise(fcb1010(), rng).get_history()
+
+    def edit_snapshot():
+        history.config.preset[42].cc1_value ^= 1
+        history.snapshot()
+
+    def show():
+        with contextlib.redirect_stdout(io.StringIO()):
+            config.show_config()
+
+    benchmarks = {
+        'parse_sysex bytes': lambda: target.parse_sysex(raw),
+        'parse_sysex list': lambda: target.parse_sysex(raw_list),
+        'parse_sysex lazy': lambda: target.parse_sysex(raw, lazy=True),
+        'get_raw_sysex full': encode_full,
+        'get_raw_sysex edit': encode_edit,
+        'get_raw_sysex default': lambda: default.get_raw_sysex(),
+        'load csv': lambda: target.load(io.StringIO(csv_text)),
+        'save csv': lambda: config.save(io.StringIO()),
+        'show_config': show,
+        'find': lambda: config.find('pc1', 10),
+        'find after edit': edit_find,
+        'snapshot after edit': edit_snapshot,
+        'undo redo': lambda: (history.undo(), history.redo()),
+    }
+    results = {}
+    for name, func in benchmarks.items():
+        results[name] = measure(func)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark and round-trip checks for fcb1010")
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help="Baseline file [Default: benchmark_baseline.json]")
+    parser.add_argument('--save-baseline', action='store_true', help="Store results as new baseline")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Permitted fractional drop in throughput [Default: 0.25]")
+    parser.add_argument('--rounds', type=int, default=50, help="Quantity of random round-trip configurations [Default: 50]")
+    args = parser.parse_args(argv)
+
+    failures = check_round_trips(args.rounds)
+    for failure in failures[:20]:
+        print("FAIL", failure)
+    print("Round-trip checks: %d configurations, %d failures" % (args.rounds, len(failures)))
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    results = run_benchmarks()
+    regressions = 0
+    print("%-24s %14s %12s %10s" % ("Benchmark", "ops/sec", "bytes/op", "baseline"))
+    for name, (rate, allocated) in results.items():
+        change = ''
+        if name in baseline:
+            ratio = rate / baseline[name]['ops']
+            change = "%+.0f%%" % ((ratio - 1) * 100)
+            if ratio < 1 - args.threshold:
+                change += " REGRESSED"
+                regressions += 1
+        print("%-24s %14.0f %12d %10s" % (name, rate, allocated, change))
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump({name: {'ops': rate, 'bytes': allocated} for name, (rate, allocated) in results.items()}, file, indent=1)
+        print("Saved baseline", args.baseline)
+    return 1 if failures or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
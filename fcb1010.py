@@ -7,420 +7,2468 @@
 #   There is no affiliation with Behringer. This is all reverse engineered
 #
 #   Depends on rtmidi which provides MIDI interface on a range of platforms - only tested on Linux ALSA
+#
+#   Run as a script to validate, convert or normalize files: python fcb1010.py --help
+
+import argparse
+import asyncio
+import collections
+import contextlib
+import csv
+import functools
+import hashlib
+import io
+import itertools
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+
+
+#   Sysex layout
+#   Preset parameters are packed 7 per 8 bytes from offset 7. The 8th byte of each group holds 7 enable flags.
+#   Each preset has 16 parameters and 16 enable flags, stored consecutively for presets 0..99.
+#   Offset and slice maps are computed once at import so encoding and decoding are bulk slice operations.
+
+_SYSEX_SIZE = 2352
+_SYSEX_HEADER = bytes((240, 0, 32, 50, 1, 12, 15))
+_PRESET_COUNT = 100
+_PARAM_START = 7
+_FLAG_START = 14
+_PRESET_END = 1839 # First byte after preset data
+
+#   Preset parameter names in sysex order
+_PARAM_FIELDS = ('pc1_program', 'pc2_program', 'pc3_program', 'pc4_program', 'pc5_program',
+    'cc1_controller', 'cc1_value', 'cc2_controller', 'cc2_value',
+    'expA_controller', 'expA_min', 'expA_max', 'expB_controller', 'expB_min', 'expB_max', 'note_value')
+
+#   Preset enable flags in sysex order as (name, inverted). None is an unused flag
+_FLAG_LAYOUT = (('pc1_enabled', True), ('pc2_enabled', True), ('pc3_enabled', True), ('pc4_enabled', True),
+    ('pc5_enabled', True), ('cc1_enabled', True), ('switch1_enabled', False), ('cc2_enabled', True),
+    ('switch2_enabled', False), ('expA_enabled', True), (None, False), (None, False),
+    ('expB_enabled', True), (None, False), (None, False), ('note_enabled', True))
+_FLAG_FIELDS = tuple(name for name, inverted in _FLAG_LAYOUT if name)
+
+_FIELDS_PER_PRESET = len(_PARAM_FIELDS)
+_VALUE_COUNT = _PRESET_COUNT * _FIELDS_PER_PRESET
+_GROUP_COUNT = (_VALUE_COUNT + 6) // 7
+
+#   Sysex offset of each preset parameter, indexed by preset * 16 + parameter
+_PARAM_OFFSETS = tuple(_PARAM_START + n + n // 7 for n in range(_VALUE_COUNT))
+#   Sysex offset and bit mask of each preset enable flag, indexed by preset * 16 + flag
+_FLAG_OFFSETS = tuple((_FLAG_START + 8 * (n // 7), 1 << (n % 7)) for n in range(_VALUE_COUNT))
+#   (flat slice, sysex slice) pairs mapping the 7 byte lanes of each 8 byte group
+_PARAM_SLICES = tuple((slice(lane, _VALUE_COUNT, 7),
+    slice(_PARAM_START + lane, _PARAM_START + lane + 8 * len(range(lane, _VALUE_COUNT, 7)), 8)) for lane in range(7))
+_FLAG_SLICE = slice(_FLAG_START, _FLAG_START + 8 * _GROUP_COUNT, 8)
+_FLAG_LANES = tuple(slice(lane, _VALUE_COUNT, 7) for lane in range(7))
+#   Bits of the flag bytes (as one little endian integer) not used by any preset field, preserved when encoding
+_FLAG_UNUSED_MASK = sum(1 << (8 * (n // 7) + n % 7) for n in range(7 * _GROUP_COUNT)
+    if n >= _VALUE_COUNT or not _FLAG_LAYOUT[n % 16][0])
+
+#   Translation tables: extract bit n as 0/1, move bit 0 to bit n, invert 0/1
+_BIT_TABLES = tuple(bytes((value >> lane) & 1 for value in range(256)) for lane in range(7))
+_SHIFT_TABLES = tuple(bytes((value & 1) << lane for value in range(256)) for lane in range(7))
+_INVERT_TABLE = bytes(int(not value) for value in range(256))
+
+#   Global MIDI channels as (name, offset, duplicate offset)
+_GLOBAL_CHANNELS = (('pc1_midi_channel', 2311, 2331), ('pc2_midi_channel', 2312, 2332),
+    ('pc3_midi_channel', 2313, 2333), ('pc4_midi_channel', 2314, 2335), ('pc5_midi_channel', 2315, 2336),
+    ('cc1_midi_channel', 2316, 2337), ('cc2_midi_channel', 2317, 2338), ('expA_midi_channel', 2319, 2339),
+    ('expB_midi_channel', 2320, 2340), ('note_midi_channel', 2321, 2341))
+#   Global switches as (name, offset, bit mask)
+_GLOBAL_SWITCHES = (('direct_select', 2330, 2), ('running_status', 2330, 4), ('merge', 2330, 16),
+    ('switch1', 2334, 4), ('switch2', 2329, 64))
+#   Global expression pedal calibration as (name, offset)
+_GLOBAL_CALIBRATION = (('expA_calibration_min', 2343), ('expA_calibration_max', 2344),
+    ('expB_calibration_min', 2345), ('expB_calibration_max', 2346))
+_GLOBAL_NAMES = tuple(name for name, *layout in _GLOBAL_CHANNELS + _GLOBAL_SWITCHES + _GLOBAL_CALIBRATION)
+_GLOBAL_FIELDS = frozenset(_GLOBAL_NAMES)
+
+#   Valid range of each field as (minimum, maximum)
+_FIELD_LIMITS = dict([(field, (0, 127)) for field in _PARAM_FIELDS] + [(field, (0, 1)) for field in _FLAG_FIELDS]
+    + [(name, (0, 15)) for name, *layout in _GLOBAL_CHANNELS] + [(name, (0, 1)) for name, *layout in _GLOBAL_SWITCHES]
+    + [(name, (0, 127)) for name, *layout in _GLOBAL_CALIBRATION])
+#   Translation tables limiting a byte to a maximum value and marking bytes above a maximum value as non-ASCII
+_CLAMP_TABLES = {limit: bytes(min(value, limit) for value in range(256)) for limit in (1, 127)}
+_RANGE_TABLES = {limit: bytes(0 if value <= limit else 128 for value in range(256)) for limit in (1, 127)}
+
+#   Per preset patch tables: ((field, offset), ...) for parameters, ((field, inverted, offset, mask), ...) for flags
+_PRESET_PARAM_PATCH = tuple(tuple((field, _PARAM_OFFSETS[preset * _FIELDS_PER_PRESET + index])
+    for index, field in enumerate(_PARAM_FIELDS)) for preset in range(_PRESET_COUNT))
+_PRESET_FLAG_PATCH = tuple(tuple((field, inverted) + _FLAG_OFFSETS[preset * _FIELDS_PER_PRESET + index]
+    for index, (field, inverted) in enumerate(_FLAG_LAYOUT) if field) for preset in range(_PRESET_COUNT))
+#   Quantity of changed presets above which the whole preset area is re-encoded
+_PATCH_LIMIT = 20
+
+#   Constant content of every dump
+_SYSEX_TEMPLATE = bytearray(_SYSEX_SIZE)
+_SYSEX_TEMPLATE[:7] = _SYSEX_HEADER
+_SYSEX_TEMPLATE[_PRESET_END:2311] = b'\x7f' * (2311 - _PRESET_END)
+_SYSEX_TEMPLATE[2334] = 3
+_SYSEX_TEMPLATE[_SYSEX_SIZE - 1] = 247
+_SYSEX_TEMPLATE = bytes(_SYSEX_TEMPLATE)
+#   MIDI realtime messages which may be interleaved with sysex
+_REALTIME_BYTES = bytes(range(0xf8, 0x100))
+
+#   MIDI wire rate in baud and bits per byte including start and stop bits
+_MIDI_BAUD = 31250
+_MIDI_BITS_PER_BYTE = 10
+
+#   CSV file structure
+#   Titles are split over two lines in the first row when saved. Loading accepts any whitespace within titles
+_CSV_TITLES = ('Global', '', 'Program Change 1', '', 'Program Change 2', '', 'Program Change 3', '', 'Program Change 4', '',
+    'Program Change 5', '', 'Continuous\nController 1', '', '', 'Continuous\nController 2', '', '', 'Switch 1', 'Switch 2',
+    'Expression\nPedal A', '', '', '', 'Expression\nPedal B', '', '', '', 'Note', '')
+_CSV_HEADER = ([' '.join(title.split()) for title in _CSV_TITLES], None,
+    ['Bank', 'Preset', 'Enabled', 'Program', 'Enabled', 'Program', 'Enabled', 'Program', 'Enabled', 'Program', 'Enabled',
+    'Program', 'Enabled', 'Controller', 'Value', 'Enabled', 'Controller', 'Value', 'Enabled', 'Enabled', 'Enabled',
+    'Controller', 'Minimum', 'Maximum', 'Enabled', 'Controller', 'Minimum', 'Maximum', 'Enabled', 'Value'])
+_CSV_COLUMNS = len(_CSV_TITLES)
+#   MIDI channel columns of second row as (name, column)
+_CSV_CHANNELS = (('pc1_midi_channel', 2), ('pc2_midi_channel', 4), ('pc3_midi_channel', 6), ('pc4_midi_channel', 8),
+    ('pc5_midi_channel', 10), ('cc1_midi_channel', 12), ('cc2_midi_channel', 15), ('expA_midi_channel', 20),
+    ('expB_midi_channel', 24), ('note_midi_channel', 28))
+#   Preset columns as (name, column, is flag)
+_CSV_FIELDS = tuple((field, column, field in _FLAG_FIELDS) for column, field in enumerate((
+    'pc1_enabled', 'pc1_program', 'pc2_enabled', 'pc2_program', 'pc3_enabled', 'pc3_program', 'pc4_enabled', 'pc4_program',
+    'pc5_enabled', 'pc5_program', 'cc1_enabled', 'cc1_controller', 'cc1_value', 'cc2_enabled', 'cc2_controller', 'cc2_value',
+    'switch1_enabled', 'switch2_enabled', 'expA_enabled', 'expA_controller', 'expA_min', 'expA_max',
+    'expB_enabled', 'expB_controller', 'expB_min', 'expB_max', 'note_enabled', 'note_value'), 2))
+
+#   MIDI messages sent when a preset is selected, in order, as (enable field, status, (channel, data fields...))
+_EMULATOR_MESSAGES = (
+    ('pc1_enabled', 0xc0, ('pc1_midi_channel', 'pc1_program')),
+    ('pc2_enabled', 0xc0, ('pc2_midi_channel', 'pc2_program')),
+    ('pc3_enabled', 0xc0, ('pc3_midi_channel', 'pc3_program')),
+    ('pc4_enabled', 0xc0, ('pc4_midi_channel', 'pc4_program')),
+    ('pc5_enabled', 0xc0, ('pc5_midi_channel', 'pc5_program')),
+    ('cc1_enabled', 0xb0, ('cc1_midi_channel', 'cc1_controller', 'cc1_value')),
+    ('cc2_enabled', 0xb0, ('cc2_midi_channel', 'cc2_controller', 'cc2_value')),
+    ('note_enabled', 0x90, ('note_midi_channel', 'note_value')))
+
+#   Reverse index message types as (type, enable field, number field, channel field)
+_INDEX_TYPES = tuple((type, type + '_enabled', number, type + '_midi_channel') for type, number in (
+    ('pc1', 'pc1_program'), ('pc2', 'pc2_program'), ('pc3', 'pc3_program'), ('pc4', 'pc4_program'), ('pc5', 'pc5_program'),
+    ('cc1', 'cc1_controller'), ('cc2', 'cc2_controller'), ('expA', 'expA_controller'), ('expB', 'expB_controller'),
+    ('note', 'note_value')))
+_INDEX_CHANNELS = {type: channel for type, enable, number, channel in _INDEX_TYPES}
+
+#   Configuration archive file structure
+_ARCHIVE_MAGIC = b'FCB1010A'
+_ARCHIVE_VERSION = 1
+_ARCHIVE_NAME_SIZE = 64
+_ARCHIVE_HEADER = struct.Struct('<8sHHIQ8x')
+_ARCHIVE_ENTRY = struct.Struct('<%dsd16sQ' % _ARCHIVE_NAME_SIZE)
+
+
+#   Check sysex data is a complete FCB1010 dump
+#   data: Raw sysex data as bytes, bytearray, memoryview or list of integers
+#   returns: Data as bytes-like object or None if not valid FCB1010 sysex. A memoryview is not copied
+def _validate_sysex(data):
+    if isinstance(data, memoryview) and data.format == 'B' and data.ndim == 1:
+        pass
+    elif not isinstance(data, (bytes, bytearray)):
+        try:
+            data = bytes(data)
+        except (TypeError, ValueError):
+            return None
+    if len(data) != _SYSEX_SIZE or data[:7] != _SYSEX_HEADER or data[_SYSEX_SIZE - 1] != 247:
+        return None
+    return data
+
+
+#   Get reason sysex data is not a valid FCB1010 dump
+#   data: Raw sysex data rejected by _validate_sysex
+#   returns: 'type', 'size', 'header' or 'terminator'
+def _sysex_error(data):
+    try:
+        data = bytes(data)
+    except (TypeError, ValueError):
+        return 'type'
+    if len(data) != _SYSEX_SIZE:
+        return 'size'
+    if data[:7] != _SYSEX_HEADER:
+        return 'header'
+    return 'terminator'
+
+
+#   Decode preset data from sysex
+#   data: Validated raw sysex
+#   returns: Dictionary of 100 element bytearray per preset field (enable flags as 0/1)
+def _decode_presets(data):
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    values = bytearray(_VALUE_COUNT)
+    for flat, wire in _PARAM_SLICES:
+        values[flat] = data[wire]
+    flag_bytes = data[_FLAG_SLICE]
+    flags = bytearray(_VALUE_COUNT)
+    for lane, flat in enumerate(_FLAG_LANES):
+        flags[flat] = flag_bytes.translate(_BIT_TABLES[lane])[:len(range(lane, _VALUE_COUNT, 7))]
+    columns = {}
+    for index, field in enumerate(_PARAM_FIELDS):
+        columns[field] = values[index::_FIELDS_PER_PRESET]
+    for index, (field, inverted) in enumerate(_FLAG_LAYOUT):
+        if field:
+            column = flags[index::_FIELDS_PER_PRESET]
+            columns[field] = column.translate(_INVERT_TABLE) if inverted else column
+    return columns
+
+
+#   Encode preset data into sysex
+#   buffer: 2352 byte bytearray initialised from template or previously encoded sysex. Unused flags are preserved
+#   columns: Dictionary of 100 element bytes-like object per preset field (enable flags as 0/1)
+def _encode_presets(buffer, columns):
+    values = bytearray(_VALUE_COUNT)
+    for index, field in enumerate(_PARAM_FIELDS):
+        values[index::_FIELDS_PER_PRESET] = columns[field]
+    for flat, wire in _PARAM_SLICES:
+        buffer[wire] = values[flat]
+    flags = bytearray(_VALUE_COUNT)
+    for index, (field, inverted) in enumerate(_FLAG_LAYOUT):
+        if field:
+            column = bytes(columns[field])
+            flags[index::_FIELDS_PER_PRESET] = column.translate(_INVERT_TABLE) if inverted else column
+    # Flag lanes occupy different bits so may be combined as one big integer
+    packed = int.from_bytes(buffer[_FLAG_SLICE], 'little') & _FLAG_UNUSED_MASK
+    for lane, flat in enumerate(_FLAG_LANES):
+        packed |= int.from_bytes(flags[flat].translate(_SHIFT_TABLES[lane]), 'little')
+    buffer[_FLAG_SLICE] = packed.to_bytes(_GROUP_COUNT, 'little')
+
+
+#   Encode one preset into previously encoded sysex
+#   buffer: 2352 byte bytearray holding encoded sysex
+#   columns: Dictionary of bytes-like object per preset field (enable flags as 0/1)
+#   index: Index of preset
+def _encode_preset(buffer, columns, index):
+    for field, offset in _PRESET_PARAM_PATCH[index]:
+        buffer[offset] = columns[field][index]
+    for field, inverted, offset, mask in _PRESET_FLAG_PATCH[index]:
+        if columns[field][index] != inverted:
+            buffer[offset] |= mask
+        else:
+            buffer[offset] &= ~mask
+
+
+#   Decode global data from sysex
+#   data: Validated raw sysex
+#   config: Object to populate with global attributes
+def _decode_globals(data, config):
+    for name, offset, duplicate in _GLOBAL_CHANNELS:
+        setattr(config, name, data[offset])
+    for name, offset, mask in _GLOBAL_SWITCHES:
+        setattr(config, name, (data[offset] & mask) == mask)
+    for name, offset in _GLOBAL_CALIBRATION:
+        setattr(config, name, data[offset])
+
+
+#   Encode global data into sysex
+#   buffer: 2352 byte bytearray initialised from template
+#   config: Object holding global attributes
+def _encode_globals(buffer, config):
+    for name, offset, duplicate in _GLOBAL_CHANNELS:
+        buffer[offset] = buffer[duplicate] = getattr(config, name)
+    for name, offset, mask in _GLOBAL_SWITCHES:
+        if getattr(config, name):
+            buffer[offset] |= mask
+        else:
+            buffer[offset] &= ~mask
+    for name, offset in _GLOBAL_CALIBRATION:
+        buffer[offset] = getattr(config, name)
+
+
+#   Read sysex file into one buffer
+#   file: Absolute or relative path and filename or binary file object
+#   returns: Content as bytes or None on failure
+def _read_syx(file):
+    try:
+        if isinstance(file, (str, bytes, os.PathLike)):
+            with open(file, 'rb') as syx_file:
+                return syx_file.read()
+        return bytes(file.read())
+    except (OSError, TypeError):
+        print("Failed to read file", file)
+        return None
+
+
+#   Find FCB1010 dumps within data, e.g. a file of concatenated sysex messages
+#   data: bytes-like object
+#   returns: Iterator of memoryview of each valid dump
+def _find_dumps(data):
+    view = memoryview(data)
+    pos = data.find(_SYSEX_HEADER)
+    while pos >= 0:
+        if pos + _SYSEX_SIZE <= len(data) and data[pos + _SYSEX_SIZE - 1] == 247:
+            yield view[pos:pos + _SYSEX_SIZE]
+            pos += _SYSEX_SIZE
+        else:
+            pos += 1
+        pos = data.find(_SYSEX_HEADER, pos)
+
+
+#   Default value of each preset field. pc1_program defaults to the preset index
+_PRESET_DEFAULTS = {
+    'pc1_enabled': True, 'pc2_enabled': False, 'pc3_enabled': False, 'pc4_enabled': False, 'pc5_enabled': False,
+    'cc1_enabled': False, 'cc2_enabled': False, 'switch1_enabled': False, 'switch2_enabled': False,
+    'expA_enabled': True, 'expB_enabled': True, 'note_enabled': False,
+    'pc1_program': 0, 'pc2_program': 0, 'pc3_program': 0, 'pc4_program': 0, 'pc5_program': 0,
+    'cc1_controller': 0, 'cc1_value': 0, 'cc2_controller': 0, 'cc2_value': 0,
+    'expA_controller': 27, 'expA_min': 0, 'expA_max': 127, 'expB_controller': 7, 'expB_min': 0, 'expB_max': 127,
+    'note_value': 60}
+
+
+#   Default value of each global field
+_GLOBAL_DEFAULTS = {
+    'pc1_midi_channel': 0, 'pc2_midi_channel': 0, 'pc3_midi_channel': 0, 'pc4_midi_channel': 0, 'pc5_midi_channel': 0,
+    'cc1_midi_channel': 0, 'cc2_midi_channel': 0, 'expA_midi_channel': 0, 'expB_midi_channel': 0, 'note_midi_channel': 0,
+    'direct_select': False, 'running_status': True, 'merge': True, 'switch1': False, 'switch2': False,
+    'expA_calibration_min': 0, 'expA_calibration_max': 127, 'expB_calibration_min': 0, 'expB_calibration_max': 127}
+
+
+#   Class holding the parameters of a set of presets as one contiguous bytearray per field
+#   Enable flags are stored as 0/1. Values are limited to 0..255 by the bytearray
+#   Presets changed through set or set_range are recorded in dirty until cleared by the owner
+#   Decoding of sysex may be deferred. Each preset is decoded when first accessed through get, set or set_range and
+#   all remaining presets are decoded when columns is accessed.
+class fcb1010_preset_store:
+    __slots__ = ('_columns', 'count', 'dirty', 'watchers', 'generation', '_source', '_loaded', '_pending')
+
+    #   Constructor
+    #   count: Quantity of presets [Default: 100]
+    def __init__(self, count=_PRESET_COUNT):
+        self.count = count
+        self.dirty = set()
+        self.watchers = [] # Sets which also receive index of each changed preset, e.g. for fcb1010_index
+        self.generation = 0 # Incremented when all presets are replaced
+        self._source = None
+        self._loaded = None # Per preset 1 if decoded from source
+        self._pending = 0 # Quantity of presets not yet decoded from source
+        self._columns = {}
+        for field, value in _PRESET_DEFAULTS.items():
+            self._columns[field] = bytearray((int(value),)) * count
+        self._columns['pc1_program'][:] = bytes(index & 127 for index in range(count))
+
+    #   Dictionary of bytearray per preset field
+    @property
+    def columns(self):
+        if self._source is not None:
+            self.load()
+        return self._columns
+
+    #   Set presets from sysex when they are next accessed
+    #   data: Validated raw sysex holding 100 presets, e.g. memoryview of a mapped file. Must not change until decoded
+    def defer(self, data):
+        self.generation += 1
+        self._source = data
+        self._loaded = bytearray(self.count)
+        self._pending = self.count
+
+    #   Decode all presets not yet decoded from deferred sysex
+    def load(self):
+        data = self._source
+        if data is None:
+            return
+        if self._pending == self.count:
+            self._source = None
+            for field, column in _decode_presets(data).items():
+                self._columns[field][:] = column
+            return
+        for index in range(self.count):
+            if not self._loaded[index]:
+                self.load_preset(index)
+
+    #   Decode one preset from deferred sysex
+    #   index: Index of preset
+    def load_preset(self, index):
+        data = self._source
+        columns = self._columns
+        for field, offset in _PRESET_PARAM_PATCH[index]:
+            columns[field][index] = data[offset]
+        for field, inverted, offset, mask in _PRESET_FLAG_PATCH[index]:
+            columns[field][index] = ((data[offset] & mask) == 0) == inverted
+        self._loaded[index] = 1
+        self._pending -= 1
+        if self._pending == 0:
+            self._source = None
+
+    #   Check whether decoding of sysex is deferred
+    #   returns: True if columns have not yet been decoded from sysex
+    def is_deferred(self):
+        return self._source is not None
+
+    #   Get a field value of one preset
+    #   field: Name of preset field
+    #   index: Index of preset within store
+    #   returns: Field value
+    def get(self, field, index):
+        if self._source is not None and not self._loaded[index]:
+            self.load_preset(index)
+        return self._columns[field][index]
+
+    #   Set a field value of one preset
+    #   field: Name of preset field
+    #   index: Index of preset within store
+    #   value: Value to set
+    def set(self, field, index, value):
+        if self._source is not None and not self._loaded[index]:
+            self.load_preset(index)
+        self._columns[field][index] = value
+        self.dirty.add(index)
+        for watcher in self.watchers:
+            watcher.add(index)
+
+    #   Record presets changed by writing to columns directly
+    #   indices: Iterable of preset indices
+    def mark(self, indices):
+        self.dirty.update(indices)
+        for watcher in self.watchers:
+            watcher.update(indices)
+
+    #   Set a field value of a range of presets in one operation
+    #   field: Name of preset field
+    #   value: Value to set or sequence of values, one per preset in range
+    #   start: Index of first preset
+    #   stop: Index after last preset
+    def set_range(self, field, value, start, stop):
+        if isinstance(value, int):
+            value = bytes((value,)) * (stop - start)
+        else:
+            value = bytes(value)
+            if len(value) != stop - start:
+                raise ValueError("Expected %d values" % (stop - start))
+        if self._source is not None:
+            for index in range(start, stop):
+                if not self._loaded[index]:
+                    self.load_preset(index)
+        self._columns[field][start:stop] = value
+        self.mark(range(start, stop))
+
+
+#   Build a property that exposes one column of a preset store
+#   field: Name of preset field
+#   flag: True for boolean enable flags
+#   returns: Property
+def _preset_property(field, flag):
+    if flag:
+        def getter(self):
+            return self._store.get(field, self._index) == 1
+        def setter(self, value):
+            self._store.set(field, self._index, 1 if value else 0)
+    else:
+        def getter(self):
+            return self._store.get(field, self._index)
+        def setter(self, value):
+            self._store.set(field, self._index, value)
+    return property(getter, setter)
 
 
 #   Class representing the parameters of a FB1010 preset
+#   Parameters are held in a fcb1010_preset_store. Each instance is a view of one preset within the store
 class fcb1010_preset:
+    __slots__ = ('_store', '_index')
+
+    #   Constructor
+    #   pc1_default: MIDI program to send for program change 1 (ignored if store provided)
+    #   store: fcb1010_preset_store to view [Default: Create a store holding just this preset]
+    #   index: Index of preset within store
+    def __init__(self, pc1_default=0, store=None, index=0):
+        if store is None:
+            store = fcb1010_preset_store(1)
+            store.set('pc1_program', 0, pc1_default)
+            index = 0
+        self._store = store
+        self._index = index
+
+for _field in _PARAM_FIELDS:
+    setattr(fcb1010_preset, _field, _preset_property(_field, False))
+for _field in _FLAG_FIELDS:
+    setattr(fcb1010_preset, _field, _preset_property(_field, True))
+del _field
+
+
+#   Class collecting counters and timing histograms from fcb1010 operations
+#   Enable for all objects with fcb1010.stats = fcb1010_stats() or for one object by setting its stats attribute.
+#   When stats is None (default) each instrumented operation costs one attribute test.
+#   Counters include:
+#       parse_sysex.accepted, parse_sysex.rejected.<reason> (type, size, header, terminator)
+#       get_raw_sysex.full, get_raw_sysex.incremental, get_raw_sysex.cached
+#       <load|save|load_syx|save_syx>.ok, <load|save|load_syx|save_syx>.failed
+#       midi_in.bytes, midi_in.dumps, midi_in.errors, midi_out.bytes, midi_out.packets, midi_out.dumps
+#   Timings (nanoseconds) include parse_sysex, get_raw_sysex, load, save, load_syx, save_syx, midi_out.send
+class fcb1010_stats:
     #   Constructor
-    #   pc1_default: MIDI program to send for program change 1
-    def __init__(self, pc1_default):
-        self.pc1_enabled = True
-        self.pc2_enabled = False
-        self.pc3_enabled = False
-        self.pc4_enabled = False
-        self.pc5_enabled = False
-        self.cc1_enabled = False
-        self.cc2_enabled = False
-        self.switch1_enabled = False
-        self.switch2_enabled = False
-        self.expA_enabled = True
-        self.expB_enabled = True
-        self.note_enabled = False
-        self.pc1_program = pc1_default
-        self.pc2_program = 0
-        self.pc3_program = 0
-        self.pc4_program = 0
-        self.pc5_program = 0
-        self.cc1_controller = 0
-        self.cc1_value = 0
-        self.cc2_controller = 0
-        self.cc2_value = 0
-        self.expA_controller = 27
-        self.expA_min = 0
-        self.expA_max = 127
-        self.expB_controller = 7
-        self.expB_min = 0
-        self.expB_max = 127
-        self.note_value = 60
+    #   callback: Function called with (name, value) for each event. Value is nanoseconds for timings or the
+    #       increment for counters
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.reset()
+
+    #   Clear all counters and timings
+    def reset(self):
+        self.counters = {}
+        self.timings = {} # Map of name to [count, total, maximum, {bucket: count}]
+        self.start = time.monotonic()
+
+    #   Increment a counter
+    #   name: Counter name
+    #   value: Increment [Default: 1]
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+        if self.callback:
+            self.callback(name, value)
+
+    #   Record duration of an operation
+    #   name: Timing name
+    #   duration: Duration in nanoseconds
+    def time(self, name, duration):
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = [0, 0, 0, {}]
+        timing[0] += 1
+        timing[1] += duration
+        if duration > timing[2]:
+            timing[2] = duration
+        # Buckets are powers of two nanoseconds
+        bucket = duration.bit_length()
+        timing[3][bucket] = timing[3].get(bucket, 0) + 1
+        if self.callback:
+            self.callback(name, duration)
+
+    #   Get current statistics
+    #   returns: Dictionary with 'counters' (name: count), 'timings' (name: dictionary with count, mean, max in
+    #       seconds and histogram of upper bound in seconds: count), 'rates' (bytes per second for each *.bytes counter)
+    #       and 'elapsed' (seconds since reset)
+    def snapshot(self):
+        elapsed = time.monotonic() - self.start
+        timings = {}
+        for name, (count, total, maximum, buckets) in self.timings.items():
+            timings[name] = {
+                'count': count,
+                'mean': total / count / 1e9,
+                'max': maximum / 1e9,
+                'histogram': {(1 << bucket) / 1e9: buckets[bucket] for bucket in sorted(buckets)}}
+        rates = {}
+        for name, value in self.counters.items():
+            if name.endswith('.bytes') and elapsed > 0:
+                rates[name] = value / elapsed
+        return {'counters': dict(self.counters), 'timings': timings, 'rates': rates, 'elapsed': elapsed}
+
+
+#   Print summary of values which cannot be sent to FCB1010
+#   message: Description of action refused, e.g. "Invalid configuration not sent:"
+#   violations: List of (bank, preset, field, value, reason) from fcb1010.validate
+def _print_violations(message, violations):
+    print(message, len(violations), "invalid values")
+    for violation in violations[:10]:
+        print("  Bank %s preset %s %s = %r: %s" % violation)
+
+
+#   Decorate a fcb1010 method returning True on success to record its duration and result when stats enabled
+#   name: Name used for timing and counters
+#   returns: Decorator
+def _instrumented(name):
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            stats = self.stats
+            if stats is None:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter_ns()
+            result = method(self, *args, **kwargs)
+            stats.time(name, time.perf_counter_ns() - start)
+            stats.count(name + ('.ok' if result else '.failed'))
+            return result
+        return wrapper
+    return decorator
 
 
 #   Class representing the complete FCB1010 configuration exposed by MIDI sysex
 #   Initialised similar to FCB1010 default
 class fcb1010:
+    stats = None # fcb1010_stats object to collect instrumentation or None to disable
+
     def __init__(self):
-        self.preset = [fcb1010_preset(i) for i in range(100)]
-        self.pc1_midi_channel = 0
-        self.pc2_midi_channel = 0
-        self.pc3_midi_channel = 0
-        self.pc4_midi_channel = 0
-        self.pc5_midi_channel = 0
-        self.cc1_midi_channel = 0
-        self.cc2_midi_channel = 0
-        self.expA_midi_channel = 0
-        self.expB_midi_channel = 0
-        self.note_midi_channel = 0
-        self.direct_select = False
-        self.running_status = True
-        self.merge = True
-        self.switch1 = False
-        self.switch2 = False
-        self.expA_calibration_min = 0
-        self.expA_calibration_max = 127
-        self.expB_calibration_min = 0
-        self.expB_calibration_max = 127
-    
-    #   Get the enable state of a preset's parameters
-    #   data: Raw sysex data as list of integers
-    #   offset: Offset of bitwise flag byte within sysex data
-    #   flag: Index of flag bit within byte
-    #   invert: True to invert the result
-    #   returns: Tuple with boolean value of flag, offset of next flag, index of next flag
-    def get_param_enable_states(self, data, offset, flag, invert):
-        result = (data[offset] & (1 << flag)) == (1 << flag)
-        if invert:
-            result = not result
-        flag += 1
-        if flag > 6:
-            flag = 0
-            offset += 8
-        return (result, offset, flag)
-    
-    #   Set the enable state of a preset's parameters within raw sysex data
-    #   data: Raw sysex data as list of integers
-    #   offset: Offset of bitwise flag byte within sysex data
-    #   flag: Index of flag bit within byte
-    #   value: Boolean value to set flag
-    #   returns: Tuple with offset of next flag, index of next flag
-    def set_param_enable_states(self, data, offset, flag, value):
-        data[offset] |= (value << flag)
-        flag += 1
-        if flag > 6:
-            flag = 0
-            offset += 8
-        return (offset, flag)
-    
-    #   Get preset parameter values
-    #   data: Raw sysex data as list of integers
-    #   offset: Offset of parameter within sysex data
-    #   returns: Tuple with parameter value of flag, offset of next parameter
-    def get_params(self, data, offset):
-        result = data[offset]
-        offset += 1
-        if ((offset - 6) % 8 == 0):
-            offset += 1
-        return (result, offset)
-    
-    #   Set preset parameter values within raw sysex data
-    #   data: Raw sysex data as list of integers
-    #   offset: Offset of parameter within sysex data
-    #   value: Value to set parameter
-    #   returns: Offset of next parameter
-    def set_params(self, data, offset, value):
-        data[offset] = value
-        offset += 1
-        if ((offset - 6) % 8 == 0):
-            offset += 1
-        return offset
-    
+        self._sysex = bytearray(_SYSEX_TEMPLATE) # Encoded sysex, updated incrementally by get_raw_sysex
+        self._encode_all = True
+        self._globals_dirty = True
+        self._index = None
+        self._history = None
+        self.presets = fcb1010_preset_store()
+        self.preset = [fcb1010_preset(store=self.presets, index=i) for i in range(_PRESET_COUNT)]
+        for name, value in _GLOBAL_DEFAULTS.items():
+            setattr(self, name, value)
+
+    #   Record changes to global fields so that cached sysex can be updated
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in _GLOBAL_FIELDS:
+            object.__setattr__(self, '_globals_dirty', True)
+
+    #   Encode all presets and globals on next get_raw_sysex
+    #   Call after modifying presets.columns directly
+    def invalidate(self):
+        self._encode_all = True
+        self.presets.dirty.clear()
+        self.presets.generation += 1
+
+    #   Get index of presets by the MIDI messages they send, creating it on first use
+    #   returns: fcb1010_index object which is kept up to date as presets change
+    def get_index(self):
+        if self._index is None:
+            self._index = fcb1010_index(self)
+        return self._index
+
+    #   Get undo / redo history, creating it on first use
+    #   depth: Maximum quantity of snapshots to keep [Default: 100]
+    #   returns: fcb1010_history object
+    def get_history(self, depth=100):
+        if self._history is None:
+            self._history = fcb1010_history(self, depth)
+        return self._history
+
+    #   Find presets which send a MIDI message
+    #   type: Message type: 'pc1'..'pc5' (program), 'cc1', 'cc2', 'expA', 'expB' (controller) or 'note' (note)
+    #   number: Program, controller or note number
+    #   channel: MIDI channel (0..15) or None for any channel
+    #   returns: Sorted list of preset indices (bank = index // 10). Only enabled parameters are matched
+    def find(self, type, number, channel=None):
+        return self.get_index().find(type, number, channel)
+
+    #   Check all presets and globals hold values that can be sent to FCB1010
+    #   Each preset field is checked across all presets in one operation and only fields with an invalid value are
+    #   examined further so this is fast enough to run after every edit
+    #   repair: True to clamp values to their valid range and replace values that are not integers with defaults
+    #   returns: List of (bank, preset, field, value, reason) for each invalid value found, bank and preset are None for
+    #       global fields. Empty if configuration is valid
+    def validate(self, repair=False):
+        violations = []
+        for name in _GLOBAL_NAMES:
+            value = getattr(self, name)
+            minimum, maximum = _FIELD_LIMITS[name]
+            if type(value) is bool or (type(value) is int and maximum == 1):
+                continue
+            if type(value) is not int:
+                violations.append((None, None, name, value, "not an integer"))
+                if repair:
+                    try:
+                        setattr(self, name, min(maximum, max(minimum, int(value))))
+                    except (TypeError, ValueError):
+                        setattr(self, name, _GLOBAL_DEFAULTS[name])
+            elif value < minimum or value > maximum:
+                violations.append((None, None, name, value, "outside range %d..%d" % (minimum, maximum)))
+                if repair:
+                    setattr(self, name, min(maximum, max(minimum, value)))
+        store = self.presets
+        columns = store.columns
+        for field in _PRESET_DEFAULTS:
+            column = columns[field]
+            maximum = _FIELD_LIMITS[field][1]
+            if column.translate(_RANGE_TABLES[maximum]).isascii():
+                continue
+            for index, value in enumerate(column):
+                if value > maximum:
+                    violations.append((index // 10, index % 10, field, value, "outside range 0..%d" % maximum))
+                    if repair:
+                        store.mark((index,))
+            if repair:
+                column[:] = column.translate(_CLAMP_TABLES[maximum])
+        violations.sort(key=lambda violation: (violation[0] is not None, violation[0] or 0, violation[1] or 0))
+        return violations
+
+    #   Get the range of preset indices in a bank
+    #   bank: Bank index (0..9) or None for all presets
+    #   returns: Tuple (start, stop) or None if bank invalid
+    def get_bank_range(self, bank=None):
+        if bank is None:
+            return (0, _PRESET_COUNT)
+        if bank < 0 or bank >= _PRESET_COUNT // 10:
+            print("Invalid bank", bank)
+            return None
+        return (bank * 10, bank * 10 + 10)
+
+    #   Get a preset field for all presets in a bank
+    #   field: Name of preset field, e.g. 'expB_controller'
+    #   bank: Bank index (0..9) or None for all presets [Default: None]
+    #   returns: bytes with one value per preset (enable flags as 0/1) or None on failure
+    def get_param(self, field, bank=None):
+        bank_range = self.get_bank_range(bank)
+        if bank_range is None:
+            return None
+        if field not in self.presets.columns:
+            print("Invalid preset field", field)
+            return None
+        return bytes(self.presets.columns[field][bank_range[0]:bank_range[1]])
+
+    #   Set a preset field for all presets in a bank as one operation
+    #   field: Name of preset field, e.g. 'expB_controller'
+    #   value: Value to set or sequence of values, one per preset
+    #   bank: Bank index (0..9) or None for all presets [Default: None]
+    #   returns: True on success
+    def set_param(self, field, value, bank=None):
+        bank_range = self.get_bank_range(bank)
+        if bank_range is None:
+            return False
+        if field not in self.presets.columns:
+            print("Invalid preset field", field)
+            return False
+        if field in _FLAG_FIELDS:
+            if isinstance(value, int):
+                value = 1 if value else 0
+            else:
+                value = [1 if flag else 0 for flag in value]
+        try:
+            self.presets.set_range(field, value, bank_range[0], bank_range[1])
+        except (TypeError, ValueError):
+            print("Invalid value for", field)
+            return False
+        return True
+
     #   Parse sysex data and populate data structures
-    #   data: Raw sysex data as list of integers
+    #   The dump is kept as the encoded sysex so unchanged data is sent back exactly as received
+    #   data: Raw sysex data as bytes, bytearray, memoryview or list of integers
+    #   lazy: True to only check framing now and decode each preset when first accessed. Data must not change until
+    #       all presets are decoded, e.g. pass a copy of a reused receive buffer
     #   returns: True if valid FCB1010 sysex parsed
-    def parse_sysex(self, data):
-        size = len(data)
-        if size != 2352 or data[0] != 240 or data[size - 1] != 247 or data[1] != 0 or data[2] != 32 or data[3] != 50 or data[4] != 1 or data[5] != 12 or data[6] != 15:
+    def parse_sysex(self, data, lazy=False):
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter_ns()
+        valid = _validate_sysex(data)
+        if valid is None:
+            if stats is not None:
+                stats.count('parse_sysex.rejected.' + _sysex_error(data))
             return False
-        offset = 14
-        flag = 0
-        for preset in range(100):
-            self.preset[preset].pc1_enabled, offset, flag = self.get_param_enable_states(data, offset, flag, True)
-            self.preset[preset].pc2_enabled, offset, flag = self.get_param_enable_states(data, offset, flag, True)
-            self.preset[preset].pc3_enabled, offset, flag = self.get_param_enable_states(data, offset, flag, True)
-            self.preset[preset].pc4_enabled, offset, flag = self.get_param_enable_states(data, offset, flag, True)
-            self.preset[preset].pc5_enabled, offset, flag = self.get_param_enable_states(data, offset, flag, True)
-            self.preset[preset].cc1_enabled, offset, flag = self.get_param_enable_states(data, offset, flag, True)
-            self.preset[preset].switch1_enabled, offset, flag = self.get_param_enable_states(data, offset, flag, False)
-            self.preset[preset].cc2_enabled, offset, flag = self.get_param_enable_states(data, offset, flag, True)
-            self.preset[preset].switch2_enabled, offset, flag = self.get_param_enable_states(data, offset, flag, False)
-            self.preset[preset].expA_enabled, offset, flag = self.get_param_enable_states(data, offset, flag, True)
-            dummy, offset, flag = self.get_param_enable_states(data, offset, flag, False)
-            dummy, offset, flag = self.get_param_enable_states(data, offset, flag, False)
-            self.preset[preset].expB_enabled, offset, flag = self.get_param_enable_states(data, offset, flag, True)
-            dummy, offset, flag = self.get_param_enable_states(data, offset, flag, False)
-            dummy, offset, flag = self.get_param_enable_states(data, offset, flag, False)
-            self.preset[preset].note_enabled, offset, flag = self.get_param_enable_states(data, offset, flag, True)
-        offset = 7
-        for preset in range(100):
-            self.preset[preset].pc1_program, offset = self.get_params(data, offset)
-            self.preset[preset].pc2_program, offset = self.get_params(data, offset)
-            self.preset[preset].pc3_program, offset = self.get_params(data, offset)
-            self.preset[preset].pc4_program, offset = self.get_params(data, offset)
-            self.preset[preset].pc5_program, offset = self.get_params(data, offset)
-            self.preset[preset].cc1_controller, offset = self.get_params(data, offset)
-            self.preset[preset].cc1_value, offset = self.get_params(data, offset)
-            self.preset[preset].cc2_controller, offset = self.get_params(data, offset)
-            self.preset[preset].cc2_value, offset = self.get_params(data, offset)
-            self.preset[preset].expA_controller, offset = self.get_params(data, offset)
-            self.preset[preset].expA_min, offset = self.get_params(data, offset)
-            self.preset[preset].expA_max, offset = self.get_params(data, offset)
-            self.preset[preset].expB_controller, offset = self.get_params(data, offset)
-            self.preset[preset].expB_min, offset = self.get_params(data, offset)
-            self.preset[preset].expB_max, offset = self.get_params(data, offset)
-            self.preset[preset].note, offset = self.get_params(data, offset)
-        self.pc1_midi_channel = data[2311]
-        self.pc2_midi_channel = data[2312]
-        self.pc3_midi_channel = data[2313]
-        self.pc4_midi_channel = data[2314]
-        self.pc5_midi_channel = data[2315]
-        self.cc1_midi_channel = data[2316]
-        self.cc2_midi_channel = data[2317]
-        self.expA_midi_channel = data[2319]
-        self.expB_midi_channel = data[2320]
-        self.note_midi_channel = data[2321]
-        self.direct_select = (data[2330] & 2) == 2
-        self.running_status = (data[2330] & 4) == 4
-        self.merge = (data[2330] & 16) == 16
-        self.switch1 = (data[2334] & 4) == 4
-        self.switch2 = (data[2329] & 64) == 64
-        self.expA_calibration_min = data[2343]
-        self.expA_calibration_max = data[2344]
-        self.expB_calibration_min = data[2345]
-        self.expB_calibration_max = data[2346]
+        self.presets.defer(valid)
+        if not lazy:
+            self.presets.load()
+        _decode_globals(valid, self)
+        self._sysex[:] = valid
+        self.presets.dirty.clear()
+        self._encode_all = False
+        self._globals_dirty = False
+        if stats is not None:
+            stats.time('parse_sysex', time.perf_counter_ns() - start)
+            stats.count('parse_sysex.accepted')
         return True
     
     #   Get raw sysex from data structures
-    #   returns: Raw sysex data as list of integers
-    def get_raw_sysex(self):
-        data = [0 for i in range(2352)]
-        data[0] = 240
-        data[1] = 0
-        data[2] = 32
-        data[3] = 50
-        data[4] = 1
-        data[5] = 12
-        data[6] = 15
-        preset = 0
-        offset = 14
-        flag = 0
-        for preset in range(100):
-            offset, flag = self.set_param_enable_states(data, offset, flag, not self.preset[preset].pc1_enabled)
-            offset, flag = self.set_param_enable_states(data, offset, flag, not self.preset[preset].pc2_enabled)
-            offset, flag = self.set_param_enable_states(data, offset, flag, not self.preset[preset].pc3_enabled)
-            offset, flag = self.set_param_enable_states(data, offset, flag, not self.preset[preset].pc4_enabled)
-            offset, flag = self.set_param_enable_states(data, offset, flag, not self.preset[preset].pc5_enabled)
-            offset, flag = self.set_param_enable_states(data, offset, flag, not self.preset[preset].cc1_enabled)
-            offset, flag = self.set_param_enable_states(data, offset, flag, self.preset[preset].switch1_enabled)
-            offset, flag = self.set_param_enable_states(data, offset, flag, not self.preset[preset].cc2_enabled)
-            offset, flag = self.set_param_enable_states(data, offset, flag, self.preset[preset].switch2_enabled)
-            offset, flag = self.set_param_enable_states(data, offset, flag, not self.preset[preset].expA_enabled)
-            offset, flag = self.set_param_enable_states(data, offset, flag, False)
-            offset, flag = self.set_param_enable_states(data, offset, flag, False)
-            offset, flag = self.set_param_enable_states(data, offset, flag, not self.preset[preset].expB_enabled)
-            offset, flag = self.set_param_enable_states(data, offset, flag, False)
-            offset, flag = self.set_param_enable_states(data, offset, flag, False)
-            offset, flag = self.set_param_enable_states(data, offset, flag, not self.preset[preset].note_enabled)
-        offset = 7
-        for preset in range(100):
-            offset = self.set_params(data, offset, self.preset[preset].pc1_program)
-            offset = self.set_params(data, offset, self.preset[preset].pc2_program)
-            offset = self.set_params(data, offset, self.preset[preset].pc3_program)
-            offset = self.set_params(data, offset, self.preset[preset].pc4_program)
-            offset = self.set_params(data, offset, self.preset[preset].pc5_program)
-            offset = self.set_params(data, offset, self.preset[preset].cc1_controller)
-            offset = self.set_params(data, offset, self.preset[preset].cc1_value)
-            offset = self.set_params(data, offset, self.preset[preset].cc2_controller)
-            offset = self.set_params(data, offset, self.preset[preset].cc2_value)
-            offset = self.set_params(data, offset, self.preset[preset].expA_controller)
-            offset = self.set_params(data, offset, self.preset[preset].expA_min)
-            offset = self.set_params(data, offset, self.preset[preset].expA_max)
-            offset = self.set_params(data, offset, self.preset[preset].expB_controller)
-            offset = self.set_params(data, offset, self.preset[preset].expB_min)
-            offset = self.set_params(data, offset, self.preset[preset].expB_max)
-            offset = self.set_params(data, offset, self.preset[preset].note_value)
-        data[2311] = self.pc1_midi_channel
-        data[2312] = self.pc2_midi_channel
-        data[2313] = self.pc3_midi_channel
-        data[2314] = self.pc4_midi_channel
-        data[2315] = self.pc5_midi_channel
-        data[2316] = self.cc1_midi_channel
-        data[2317] = self.cc2_midi_channel
-        data[2319] = self.expA_midi_channel
-        data[2320] = self.expB_midi_channel
-        data[2321] = self.note_midi_channel
-        data[2331] = self.pc1_midi_channel
-        data[2332] = self.pc2_midi_channel
-        data[2333] = self.pc3_midi_channel
-        data[2335] = self.pc4_midi_channel
-        data[2336] = self.pc5_midi_channel
-        data[2337] = self.cc1_midi_channel
-        data[2338] = self.cc2_midi_channel
-        data[2339] = self.expA_midi_channel
-        data[2340] = self.expB_midi_channel
-        data[2341] = self.note_midi_channel
-        data[2330] = 0
-        data[2329] = 0
-        data[2334] = 3
-        if self.direct_select: data[2330] |= 2
-        if self.running_status: data[2330] |= 4
-        if self.merge: data[2330] |= 16
-        if self.switch1: data[2334] |= 2
-        if self.switch2: data[2329] |= 64
-        data[2343] = self.expA_calibration_min
-        data[2344] = self.expA_calibration_max
-        data[2345] = self.expB_calibration_min
-        data[2346] = self.expB_calibration_max
-        for offset in range(1839, 2311):
-            data[offset] = 127
-        data[2351] = 247
-        return data
+    #   Encoded sysex is cached and only presets and globals changed since the previous call are re-encoded
+    #   buffer: Optional 2352 byte bytearray to encode into, e.g. reused between calls [Default: new bytearray]
+    #   returns: Raw sysex data as bytearray
+    def get_raw_sysex(self, buffer=None):
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter_ns()
+        cache = self._sysex
+        dirty = self.presets.dirty
+        if self._encode_all or len(dirty) > _PATCH_LIMIT:
+            _encode_presets(cache, self.presets.columns)
+            self._encode_all = False
+            self._globals_dirty = True
+            mode = 'get_raw_sysex.full'
+        elif dirty or self._globals_dirty:
+            if dirty:
+                # Changed presets are always decoded so avoid columns property which decodes any deferred presets
+                columns = self.presets._columns
+                for index in dirty:
+                    _encode_preset(cache, columns, index)
+            mode = 'get_raw_sysex.incremental'
+        else:
+            mode = 'get_raw_sysex.cached'
+        dirty.clear()
+        if self._globals_dirty:
+            _encode_globals(cache, self)
+            self._globals_dirty = False
+        if buffer is None:
+            buffer = bytearray(cache)
+        else:
+            buffer[:] = cache
+        if stats is not None:
+            stats.time('get_raw_sysex', time.perf_counter_ns() - start)
+            stats.count(mode)
+        return buffer
     
+    #   Read configuration from sysex (.syx) file
+    #   The file is read into one buffer and the dump is decoded directly from it
+    #   file: Absolute or relative path and filename or binary file object [Default: ./FCB1010.syx]
+    #   index: Index of dump within file containing multiple dumps [Default: 0]
+    #   returns: True on success
+    @_instrumented('load_syx')
+    def load_syx(self, file='FCB1010.syx', index=0):
+        data = _read_syx(file)
+        if data is None:
+            return False
+        for count, dump in enumerate(_find_dumps(data)):
+            if count == index:
+                return self.parse_sysex(dump)
+        print("FCB1010 sysex dump", index, "not found in", file)
+        return False
+
+    #   Save configuration to sysex (.syx) file
+    #   file: Absolute or relative path and filename or binary file object [Default: ./FCB1010.syx]
+    #   append: True to add dump to end of existing file [Default: False]
+    #   validate: True to refuse to save configuration with invalid values [Default: True]
+    #   returns: True on success
+    @_instrumented('save_syx')
+    def save_syx(self, file='FCB1010.syx', append=False, validate=True):
+        return fcb1010.save_syx_all([self], file, append, validate)
+
+    #   Read all configurations from sysex (.syx) file
+    #   file: Absolute or relative path and filename or binary file object [Default: ./FCB1010.syx]
+    #   lazy: True to decode presets when first accessed
+    #   returns: List of fcb1010 objects, one per dump in file or None on failure
+    @staticmethod
+    def load_syx_all(file='FCB1010.syx', lazy=False):
+        data = _read_syx(file)
+        if data is None:
+            return None
+        configs = []
+        for dump in _find_dumps(data):
+            config = fcb1010()
+            config.parse_sysex(dump, lazy)
+            configs.append(config)
+        return configs
+
+    #   Save configurations to one sysex (.syx) file
+    #   configs: Iterable of fcb1010 objects
+    #   file: Absolute or relative path and filename or binary file object [Default: ./FCB1010.syx]
+    #   append: True to add dumps to end of existing file [Default: False]
+    #   validate: True to refuse to save if any configuration has invalid values [Default: True]
+    #   returns: True on success
+    @staticmethod
+    def save_syx_all(configs, file='FCB1010.syx', append=False, validate=True):
+        data = bytearray()
+        buffer = bytearray(_SYSEX_SIZE)
+        for config in configs:
+            if validate:
+                violations = config.validate()
+                if violations:
+                    _print_violations("Invalid configuration not saved:", violations)
+                    return False
+            data += config.get_raw_sysex(buffer)
+        try:
+            if isinstance(file, (str, bytes, os.PathLike)):
+                with open(file, 'ab' if append else 'wb') as syx_file:
+                    syx_file.write(data)
+            else:
+                file.write(data)
+        except (OSError, TypeError):
+            print("Failed to write file", file)
+            return False
+        return True
+
+    #   Get the differences between this and another configuration
+    #   Encoded sysex is compared first then only fields whose values differ are examined
+    #   other: fcb1010 object or raw sysex data
+    #   returns: List of (bank, preset, field, value, other value) ordered by preset, bank and preset are 0..9 or
+    #       None for global fields. None if other is not valid FCB1010 sysex
+    def diff(self, other):
+        if not isinstance(other, fcb1010):
+            config = fcb1010()
+            if not config.parse_sysex(other):
+                return None
+            other = config
+        if self.get_raw_sysex() == other.get_raw_sysex():
+            return []
+        changes = []
+        for name in _GLOBAL_NAMES:
+            value = getattr(self, name)
+            other_value = getattr(other, name)
+            if value != other_value:
+                changes.append((None, None, name, value, other_value))
+        preset_changes = []
+        for order, field in enumerate(_PRESET_DEFAULTS):
+            column = self.presets.columns[field]
+            other_column = other.presets.columns[field]
+            if column == other_column:
+                continue
+            flag = field in _FLAG_FIELDS
+            for index, (value, other_value) in enumerate(zip(column, other_column)):
+                if value != other_value:
+                    if flag:
+                        value = value == 1
+                        other_value = other_value == 1
+                    preset_changes.append((index, order, field, value, other_value))
+        preset_changes.sort()
+        for index, order, field, value, other_value in preset_changes:
+            changes.append((index // 10, index % 10, field, value, other_value))
+        return changes
+
+    #   Apply differences, e.g. from diff, to this configuration
+    #   changes: Iterable of (bank, preset, field, old value, new value), bank and preset None for global fields
+    #   strict: True to fail without changing anything if any current value does not match old value
+    #   returns: True on success, False without changing anything if any field or new value is invalid
+    def apply_diff(self, changes, strict=False):
+        changes = list(changes)
+        for bank, preset, field, old_value, value in changes:
+            if bank is None:
+                if field not in _GLOBAL_FIELDS:
+                    print("Invalid global field", field)
+                    return False
+                current = getattr(self, field)
+            else:
+                if (field not in _PRESET_DEFAULTS or not isinstance(bank, int) or not isinstance(preset, int)
+                        or not 0 <= bank < 10 or not 0 <= preset < 10):
+                    print("Invalid preset field", bank, preset, field)
+                    return False
+                current = getattr(self.preset[bank * 10 + preset], field)
+            if strict and current != old_value:
+                print("Conflicting value for", bank, preset, field, current, old_value)
+                return False
+            minimum, maximum = _FIELD_LIMITS[field]
+            if not isinstance(value, int) or not minimum <= value <= maximum:
+                print("Invalid value for", bank, preset, field, value)
+                return False
+        for bank, preset, field, old_value, value in changes:
+            if bank is None:
+                setattr(self, field, value)
+            else:
+                setattr(self.preset[bank * 10 + preset], field, value)
+        return True
+
     #   Print current configuration in human readable form
-    def show_config(self):
-        for (index, preset) in enumerate(self.preset):
-            print("Preset", index)
-            print("  PC1: %s %d  PC2: %s %d  PC3: %s %d  PC4: %s %d  PC5: %s %d  CC1: %s %d %d  CC2: %s %d %d" % (
+    #   presets: Iterable of preset indices to show, e.g. from find [Default: All presets]
+    def show_config(self, presets=None):
+        for line in self.iter_config(presets):
+            print(line)
+
+    #   Get current configuration in human readable form, one line at a time
+    #   presets: Iterable of preset indices to show, e.g. from find [Default: All presets]
+    #   returns: Iterator of lines of text
+    def iter_config(self, presets=None):
+        if presets is None:
+            presets = range(_PRESET_COUNT)
+        for index in presets:
+            preset = self.preset[index]
+            yield "Preset %d" % index
+            yield ("  PC1: %s %d  PC2: %s %d  PC3: %s %d  PC4: %s %d  PC5: %s %d  CC1: %s %d %d  CC2: %s %d %d" % (
                 preset.pc1_enabled, preset.pc1_program, preset.pc2_enabled, preset.pc2_program, preset.pc3_enabled, preset.pc3_program, preset.pc4_enabled, preset.pc4_program, preset.pc5_enabled, preset.pc5_program, preset.cc1_enabled, preset.cc1_controller, preset.cc1_value, preset.cc2_enabled, preset.cc2_controller, preset.cc2_value))
-            print("  Switch 1: %s  Switch 2: %s  Expression A: %s %d %d %d  Expression B: %s %d %d %d  Note: %s %d" % (
+            yield ("  Switch 1: %s  Switch 2: %s  Expression A: %s %d %d %d  Expression B: %s %d %d %d  Note: %s %d" % (
                preset.switch1_enabled, preset.switch2_enabled, preset.expA_enabled, preset.expA_controller, preset.expA_min, preset.expA_max, preset.expB_enabled, preset.expB_controller, preset.expB_min, preset.expB_max, preset.note_enabled, preset.note_value))
-        print()
-        print("  MIDI Channels")
-        print("  PC1: %d  PC2: %d  PC3: %d  PC4: %d  PC5: %d  CC1: %d  CC2: %d  ExpA: %d  ExpB: %d  Note: %d" %
+        yield ""
+        yield "  MIDI Channels"
+        yield ("  PC1: %d  PC2: %d  PC3: %d  PC4: %d  PC5: %d  CC1: %d  CC2: %d  ExpA: %d  ExpB: %d  Note: %d" %
             (self.pc1_midi_channel, self.pc2_midi_channel, self.pc3_midi_channel, self.pc4_midi_channel, self.pc5_midi_channel, self.cc1_midi_channel, self.cc2_midi_channel, self.expA_midi_channel, self.expB_midi_channel, self.note_midi_channel))
-        print("  Direct select: %s  Running status: %s  Merge: %s  Switch 1: %s  Switch 2: %s  Exp A calibration %d %d  Exp B calibration %d %d" % (
+        yield ("  Direct select: %s  Running status: %s  Merge: %s  Switch 1: %s  Switch 2: %s  Exp A calibration %d %d  Exp B calibration %d %d" % (
             self.direct_select, self.running_status, self.merge, self.switch1, self.switch2, self.expA_calibration_min, self.expA_calibration_max, self.expB_calibration_min, self.expB_calibration_max))
     
     #   Read data from csv file
-    #   filename: Absolute or relative path and filename [Default: ./FCB1010.csv]
+    #   Rows are streamed so any readable text file object may be used, e.g. sys.stdin or io.StringIO
+    #   file: Absolute or relative path and filename or file object [Default: ./FCB1010.csv]
     #   returns: True on success
-    def load(self, filename='FCB1010.csv'):
+    @_instrumented('load')
+    def load(self, file='FCB1010.csv'):
+        if isinstance(file, (str, bytes, os.PathLike)):
+            try:
+                with open(file, newline='') as csv_file:
+                    return self._read_csv(csv_file)
+            except (OSError, UnicodeDecodeError, csv.Error):
+                print("Failed to read file", file)
+                return False
         try:
-            with open(filename) as file:
-                csv = file.read().splitlines()
-        except:
-            print("Failed to read file", filename)
+            return self._read_csv(file)
+        except (OSError, UnicodeDecodeError, csv.Error):
+            print("Failed to read file", file)
             return False
-        if len(csv) < 3:
+
+    #   Read data from csv file object
+    #   file: Readable text file object
+    #   returns: True on success
+    def _read_csv(self, file):
+        reader = csv.reader(file)
+        headers = [next(reader, None), next(reader, None), next(reader, None)]
+        if headers[2] is None:
             print("CSV has insufficient lines. Should be at least 3")
             return False
-        if csv[0] != "Global,,Program Change 1,,Program Change 2,,Program Change 3,,Program Change 4,,Program Change 5,,Continuous Controller 1,,,Continuous Controller 2,,,Switch 1,Switch 2,Expression Pedal A,,,,Expression Pedal B,,,,Note,":
+        if [' '.join(cell.split()) for cell in headers[0]] != _CSV_HEADER[0]:
             print("First line of CSV should contain headers:")
-            print("Global,,Program Change 1,,Program Change 2,,Program Change 3,,Program Change 4,,Program Change 5,,Continuous Controller 1,,,Continuous Controller 2,,,Switch 1,Switch 2,Expression Pedal A,,,,Expression Pedal B,,,,Note,")
+            print(','.join(_CSV_HEADER[0]))
             return False
-        if csv[2] != "Bank,Preset,Enabled,Program,Enabled,Program,Enabled,Program,Enabled,Program,Enabled,Program,Enabled,Controller,Value,Enabled,Controller,Value,Enabled,Enabled,Enabled,Controller,Minimum,Maximum,Enabled,Controller,Minimum,Maximum,Enabled,Value":
+        if headers[2] != _CSV_HEADER[2]:
             print("Third line of CSV should contain headers:")
-            print("Bank,Preset,Enabled,Program,Enabled,Program,Enabled,Program,Enabled,Program,Enabled,Program,Enabled,Controller,Value,Enabled,Controller,Value,Enabled,Enabled,Enabled,Controller,Minimum,Maximum,Enabled,Controller,Minimum,Maximum,Enabled,Value")
+            print(','.join(_CSV_HEADER[2]))
             return False
-        midi_channels = csv[1].split(',')
-        if len(midi_channels) != 30:
+        if len(headers[1]) != _CSV_COLUMNS:
             print("Insufficient MIDI Channel parameters.")
             return False
-        self.pc1_midi_channel = int(midi_channels[2])
-        self.pc2_midi_channel = int(midi_channels[4])
-        self.pc3_midi_channel = int(midi_channels[6])
-        self.pc4_midi_channel = int(midi_channels[8])
-        self.pc5_midi_channel = int(midi_channels[10])
-        self.cc1_midi_channel = int(midi_channels[12])
-        self.cc2_midi_channel = int(midi_channels[15])
-        self.expA_midi_channel = int(midi_channels[20])
-        self.expB_midi_channel = int(midi_channels[24])
-        self.note_midi_channel = int(midi_channels[28])
-        for i in range(3, len(csv)):
-            data = csv[i].split(',')
-            if len(data) != 30:
-                continue
-            bank = int(data[0])
-            if bank < 1 or bank > 10:
+        try:
+            channels = [(name, int(headers[1][column])) for name, column in _CSV_CHANNELS]
+        except ValueError:
+            print("Invalid MIDI Channel parameters.")
+            return False
+        if not all(0 <= channel <= 255 for name, channel in channels):
+            print("Invalid MIDI Channel parameters.")
+            return False
+        # Convert rows to integers first so that an invalid file leaves the configuration unchanged
+        rows = []
+        for row in reader:
+            if len(row) != _CSV_COLUMNS:
                 continue
-            preset = int(data[1])
-            if preset < 1 or preset > 10:
+            try:
+                values = list(map(int, row))
+            except ValueError:
+                print("Invalid values in CSV line", reader.line_num)
+                return False
+            if values[0] < 1 or values[0] > 10 or values[1] < 1 or values[1] > 10:
                 continue
-            preset = (bank - 1) * 10 + preset - 1
-            self.preset[preset].pc1_enabled = int(data[2]) == 1
-            self.preset[preset].pc1_program = int(data[3])
-            self.preset[preset].pc2_enabled = int(data[4]) == 1
-            self.preset[preset].pc2_program = int(data[5])
-            self.preset[preset].pc3_enabled = int(data[6]) == 1
-            self.preset[preset].pc3_program = int(data[7])
-            self.preset[preset].pc4_enabled = int(data[8]) == 1
-            self.preset[preset].pc4_program = int(data[9])
-            self.preset[preset].pc5_enabled = int(data[10]) == 1
-            self.preset[preset].pc5_program = int(data[11])
-            self.preset[preset].cc1_enabled = int(data[12]) == 1
-            self.preset[preset].cc1_controller = int(data[13])
-            self.preset[preset].cc1_value = int(data[14])
-            self.preset[preset].cc1_enabled = int(data[15]) == 1
-            self.preset[preset].cc1_controller = int(data[16])
-            self.preset[preset].cc1_value = int(data[17])
-            self.preset[preset].switch1_enabled = int(data[18]) == 1
-            self.preset[preset].switch2_enabled = int(data[19]) == 1
-            self.preset[preset].expA_enabled = int(data[20]) == 1
-            self.preset[preset].expA_controller = int(data[21])
-            self.preset[preset].expA_min = int(data[22])
-            self.preset[preset].expA_max = int(data[23])
-            self.preset[preset].expB_enabled = int(data[24]) == 1
-            self.preset[preset].expB_controller = int(data[25])
-            self.preset[preset].expB_min = int(data[26])
-            self.preset[preset].expB_max = int(data[27])
-            self.preset[preset].note_enabled = int(data[28]) == 1
-            self.preset[preset].note_value = int(data[29])
+            # Values above 127 are kept for validate to report but must fit in a byte
+            if min(values) < 0 or max(values) > 255:
+                print("Values out of range in CSV line", reader.line_num)
+                return False
+            rows.append(values)
+        for name, channel in channels:
+            setattr(self, name, channel)
+        columns = self.presets.columns
+        for values in rows:
+            preset = (values[0] - 1) * 10 + values[1] - 1
+            for field, column, flag in _CSV_FIELDS:
+                columns[field][preset] = (values[column] == 1) if flag else values[column]
+        self.invalidate()
         return True
-    
+
     #   Save data to csv file
-    #   filename: Absolute or relative path and filename [Default: ./FCB1010.csv]
+    #   file: Absolute or relative path and filename or writable text file object, e.g. sys.stdout [Default: ./FCB1010.csv]
+    #   returns: True on success
+    @_instrumented('save')
+    def save(self, file='FCB1010.csv'):
+        try:
+            if isinstance(file, (str, bytes, os.PathLike)):
+                with open(file, 'w', newline='') as csv_file:
+                    self._write_csv(csv_file)
+            else:
+                self._write_csv(file)
+        except (OSError, ValueError):
+            print("Failed to write file", file)
+            return False
+        return True
+
+    #   Write data to csv file object
+    #   file: Writable text file object
+    def _write_csv(self, file):
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow(_CSV_TITLES)
+        channels = ['MIDI Channel'] + [''] * (_CSV_COLUMNS - 1)
+        channels[18] = channels[19] = 'N/A'
+        for name, column in _CSV_CHANNELS:
+            channels[column] = getattr(self, name)
+        writer.writerow(channels)
+        writer.writerow(_CSV_HEADER[2])
+        columns = [self.presets.columns[field] for field, column, flag in _CSV_FIELDS]
+        rows = zip(*columns)
+        writer.writerows([index // 10 + 1, index % 10 + 1, *row] for index, row in enumerate(rows))
+
+
+#   Class providing a reverse index from MIDI messages to the presets that send them
+#   Changes to presets are recorded as they happen and applied to the index when it is next queried.
+class fcb1010_index:
+    #   Constructor
+    #   config: fcb1010 object to index
+    def __init__(self, config):
+        self.config = config
+        self._changed = set()
+        config.presets.watchers.append(self._changed)
+        self._generation = None
+        self._numbers = {} # Map of type to list of indexed number (or None if disabled) per preset
+        self._presets = {} # Map of type to map of number to set of preset indices
+
+    #   Stop tracking changes to configuration
+    def close(self):
+        if self._changed in self.config.presets.watchers:
+            self.config.presets.watchers.remove(self._changed)
+
+    #   Bring index up to date with configuration
+    def update(self):
+        store = self.config.presets
+        if self._generation != store.generation:
+            self._generation = store.generation
+            self._changed.clear()
+            columns = store.columns
+            for type, enable, number, channel in _INDEX_TYPES:
+                numbers = [value if enabled else None for enabled, value in zip(columns[enable], columns[number])]
+                presets = {}
+                for index, value in enumerate(numbers):
+                    if value is not None:
+                        presets.setdefault(value, set()).add(index)
+                self._numbers[type] = numbers
+                self._presets[type] = presets
+            return
+        if not self._changed:
+            return
+        changed = list(self._changed)
+        self._changed.clear()
+        for type, enable, number, channel in _INDEX_TYPES:
+            numbers = self._numbers[type]
+            presets = self._presets[type]
+            for index in changed:
+                value = store.get(number, index) if store.get(enable, index) else None
+                old = numbers[index]
+                if value == old:
+                    continue
+                if old is not None:
+                    presets[old].discard(index)
+                    if not presets[old]:
+                        del presets[old]
+                if value is not None:
+                    presets.setdefault(value, set()).add(index)
+                numbers[index] = value
+
+    #   Find presets which send a MIDI message
+    #   type: Message type: 'pc1'..'pc5' (program), 'cc1', 'cc2', 'expA', 'expB' (controller) or 'note' (note)
+    #   number: Program, controller or note number
+    #   channel: MIDI channel (0..15) or None for any channel
+    #   returns: Sorted list of preset indices
+    def find(self, type, number, channel=None):
+        if type not in _INDEX_CHANNELS:
+            print("Invalid message type", type)
+            return []
+        if channel is not None and getattr(self.config, _INDEX_CHANNELS[type]) != channel:
+            return []
+        self.update()
+        return sorted(self._presets[type].get(number, ()))
+
+    #   Get all numbers used by a message type
+    #   type: Message type: 'pc1'..'pc5', 'cc1', 'cc2', 'expA', 'expB' or 'note'
+    #   returns: Dictionary of number: sorted list of preset indices
+    def get_numbers(self, type):
+        if type not in _INDEX_CHANNELS:
+            print("Invalid message type", type)
+            return {}
+        self.update()
+        return {number: sorted(presets) for number, presets in sorted(self._presets[type].items())}
+
+
+#   Class providing undo / redo of configuration changes
+#   Each snapshot records only the presets changed since the previous snapshot, as (before, after) rows of
+#   preset values, and the global settings if any changed. Undo and redo write back just those presets.
+class fcb1010_history:
+    #   Constructor
+    #   config: fcb1010 object to track
+    #   depth: Maximum quantity of snapshots to keep. Oldest snapshots are discarded
+    def __init__(self, config, depth=100):
+        self.config = config
+        self._changed = set()
+        config.presets.watchers.append(self._changed)
+        self._undo = collections.deque(maxlen=depth)
+        self._redo = []
+        self._mark()
+
+    #   Stop tracking changes to configuration
+    def close(self):
+        if self._changed in self.config.presets.watchers:
+            self.config.presets.watchers.remove(self._changed)
+
+    #   Record current state of configuration as basis for next snapshot
+    def _mark(self):
+        store = self.config.presets
+        columns = store.columns
+        self._rows = [bytes(columns[field][index] for field in _PRESET_DEFAULTS) for index in range(_PRESET_COUNT)]
+        self._globals = self._get_globals()
+        self._generation = store.generation
+        self._changed.clear()
+
+    def _get_globals(self):
+        return tuple(getattr(self.config, name) for name in _GLOBAL_NAMES)
+
+    #   Get maximum quantity of snapshots kept
+    @property
+    def depth(self):
+        return self._undo.maxlen
+
+    #   Set maximum quantity of snapshots kept, discarding oldest snapshots if required
+    @depth.setter
+    def depth(self, depth):
+        self._undo = collections.deque(self._undo, maxlen=depth)
+
+    #   Check whether there are snapshots to undo
+    #   returns: True if undo is possible
+    def can_undo(self):
+        return bool(self._undo) or self.is_modified()
+
+    #   Check whether there are undone snapshots to redo
+    #   returns: True if redo is possible
+    def can_redo(self):
+        return bool(self._redo) and not self.is_modified()
+
+    #   Check whether configuration has changed since last snapshot
+    #   returns: True if changed
+    def is_modified(self):
+        return bool(self._changed) or self._generation != self.config.presets.generation or self._globals != self._get_globals()
+
+    #   Get labels of snapshots
+    #   returns: Tuple (list of undo labels, oldest first, list of redo labels, next redo first)
+    def get_labels(self):
+        return ([entry[0] for entry in self._undo], [entry[0] for entry in reversed(self._redo)])
+
+    #   Record changes since last snapshot. Discards any undone snapshots
+    #   label: Optional description of change, e.g. for editor menu
+    #   returns: True if a snapshot was recorded, False if nothing changed
+    def snapshot(self, label=None):
+        store = self.config.presets
+        if self._generation != store.generation:
+            indices = range(_PRESET_COUNT)
+        else:
+            indices = sorted(self._changed)
+        before = {}
+        after = {}
+        if indices:
+            columns = store.columns
+            for index in indices:
+                row = bytes(columns[field][index] for field in _PRESET_DEFAULTS)
+                if row != self._rows[index]:
+                    before[index] = self._rows[index]
+                    after[index] = row
+                    self._rows[index] = row
+        self._changed.clear()
+        self._generation = store.generation
+        globals = self._get_globals()
+        if globals == self._globals:
+            globals_before = globals_after = None
+        else:
+            globals_before, globals_after = self._globals, globals
+            self._globals = globals
+        if not before and globals_before is None:
+            return False
+        self._undo.append((label, before, after, globals_before, globals_after))
+        self._redo.clear()
+        return True
+
+    #   Write rows and globals to configuration
+    def _apply(self, rows, globals):
+        store = self.config.presets
+        columns = store.columns
+        for index, row in rows.items():
+            for field, value in zip(_PRESET_DEFAULTS, row):
+                columns[field][index] = value
+            self._rows[index] = row
+        store.mark(rows)
+        if globals is not None:
+            for name, value in zip(_GLOBAL_NAMES, globals):
+                setattr(self.config, name, value)
+            self._globals = globals
+        self._changed.clear()
+
+    #   Revert to previous snapshot. Changes since the last snapshot are recorded first so they may be redone
+    #   steps: Quantity of snapshots to revert
+    #   returns: True on success, False if there is nothing to undo
+    def undo(self, steps=1):
+        self.snapshot()
+        if not self._undo:
+            return False
+        for step in range(min(steps, len(self._undo))):
+            entry = self._undo.pop()
+            label, before, after, globals_before, globals_after = entry
+            self._apply(before, globals_before)
+            self._redo.append(entry)
+        return True
+
+    #   Reapply undone snapshots. Not possible after configuration is changed
+    #   steps: Quantity of snapshots to reapply
+    #   returns: True on success, False if there is nothing to redo
+    def redo(self, steps=1):
+        if not self._redo or self.is_modified():
+            return False
+        for step in range(min(steps, len(self._redo))):
+            entry = self._redo.pop()
+            label, before, after, globals_before, globals_after = entry
+            self._apply(after, globals_after)
+            self._undo.append(entry)
+        return True
+
+    #   Discard all snapshots, keeping current configuration
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+        self._mark()
+
+
+#   Class reassembling FCB1010 sysex from fragmented MIDI input
+#   Fragments are copied into a preallocated buffer. The header is checked as soon as it arrives and the dump is
+#   parsed when the terminating F7 arrives. MIDI realtime bytes interleaved with the dump are ignored.
+#   All work is proportional to the fragment size and nothing blocks so feed may be called from a MIDI callback.
+class fcb1010_receiver:
+    #   Constructor
+    #   config: fcb1010 object to populate with each received dump [Default: new fcb1010 object]
+    #   on_complete: Function called with (receiver, result) when a dump is received. Result is the populated
+    #       fcb1010 object or, if parse is False, the raw dump as bytes
+    #   on_progress: Function called with (receiver, received, total) after each fragment of a dump
+    #   on_error: Function called with (receiver, message) when a dump is rejected
+    #   parse: True to parse dumps on completion, False to pass the raw dump to on_complete for parsing elsewhere
+    #   lazy: True to only check framing on completion and decode each preset when first accessed
+    def __init__(self, config=None, on_complete=None, on_progress=None, on_error=None, parse=True, lazy=False):
+        self.config = fcb1010() if config is None else config
+        self.on_complete = on_complete
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.parse = parse
+        self.lazy = lazy
+        self.buffer = bytearray(_SYSEX_SIZE)
+        self._view = memoryview(self.buffer)
+        self.received = 0 # Bytes of current dump received, 0 when waiting for start of dump
+        self.dumps = 0 # Quantity of complete dumps received
+        self.errors = 0 # Quantity of rejected dumps
+        self.error = None # Description of last error
+
+    #   Get progress of current dump
+    #   returns: Fraction of current dump received (0..1)
+    @property
+    def progress(self):
+        return self.received / _SYSEX_SIZE
+
+    #   Abandon any partially received dump
+    def reset(self):
+        self.received = 0
+
+    #   Handle MIDI input (callback compatible with rtmidi MidiIn.set_callback)
+    #   event: Tuple with received MIDI data, time since last message
+    #   data: Unused
+    def midi_callback(self, event, data=None):
+        self.feed(event[0])
+
+    #   Process a fragment of received MIDI data
+    #   data: Received bytes as bytes, bytearray, memoryview or list of integers
+    #   returns: Quantity of complete dumps received within this fragment
+    def feed(self, data):
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(data)
+        stats = self.config.stats
+        if stats is not None:
+            stats.count('midi_in.bytes', len(data))
+        if data and max(data) >= 0xf8:
+            data = bytes(data).translate(None, _REALTIME_BYTES)
+        size = len(data)
+        pos = 0
+        completed = 0
+        while pos < size:
+            if self.received == 0:
+                pos = data.find(240, pos)
+                if pos < 0:
+                    break
+            # Copy up to the end of the dump then check for premature status bytes
+            count = min(_SYSEX_SIZE - self.received, size - pos)
+            chunk = data[pos:pos + count]
+            start = self.received
+            if start < 7:
+                # Silently skip sysex from other devices, e.g. identity reply
+                header = min(count, 7 - start)
+                if chunk[:header] != _SYSEX_HEADER[start:start + header]:
+                    mismatch = next(index for index in range(header) if chunk[index] != _SYSEX_HEADER[start + index])
+                    self.received = 0
+                    pos += mismatch # Mismatched byte may start another message
+                    continue
+            status = 0
+            if start == 0:
+                status = 1 # Skip start of sysex
+            end = count - 1 if start + count == _SYSEX_SIZE else count
+            if status < end and max(chunk[status:end]) >= 128:
+                status = next(index for index in range(status, end) if chunk[index] >= 128)
+                self._reject("Unexpected end of sysex" if chunk[status] == 247 else "Sysex interrupted by status byte")
+                pos += status
+                continue
+            self._view[start:start + count] = chunk
+            self.received += count
+            pos += count
+            if self.received < _SYSEX_SIZE:
+                break
+            if self.buffer[_SYSEX_SIZE - 1] != 247:
+                self._reject("Sysex too long")
+                pos -= 1 # Last byte may start another message
+                continue
+            self.received = 0
+            self.dumps += 1
+            completed += 1
+            if stats is not None:
+                stats.count('midi_in.dumps')
+            if self.parse:
+                if self.lazy:
+                    self.config.parse_sysex(bytes(self.buffer), True)
+                else:
+                    self.config.parse_sysex(self.buffer)
+                result = self.config
+            else:
+                result = bytes(self.buffer)
+            if self.on_complete:
+                self.on_complete(self, result)
+        if self.received and self.on_progress:
+            self.on_progress(self, self.received, _SYSEX_SIZE)
+        return completed
+
+    #   Abandon current dump and report error
+    #   message: Description of error
+    def _reject(self, message):
+        self.received = 0
+        self.errors += 1
+        self.error = message
+        if self.config.stats is not None:
+            self.config.stats.count('midi_in.errors')
+        if self.on_error:
+            self.on_error(self, message)
+
+
+#   Class emulating a pair of connected MIDI ports within the process, e.g. for testing without hardware
+#   Provides the subset of rtmidi MidiOut and MidiIn used by this module. Each message sent is recorded then
+#   passed to the input callback.
+class fcb1010_loopback_port:
+    #   Constructor
+    def __init__(self):
+        self.sent = bytearray() # All bytes sent
+        self.messages = 0 # Quantity of messages sent
+        self._callback = None
+        self._data = None
+
+    #   Send MIDI message
+    #   message: MIDI data as bytes, bytearray or list of integers
+    def send_message(self, message):
+        message = bytes(message)
+        self.sent += message
+        self.messages += 1
+        if self._callback:
+            self._callback((message, 0.0), self._data)
+
+    #   Set input callback
+    #   func: Function called with (event, data) for each message sent where event is (message, delta time)
+    #   data: Value passed to func
+    def set_callback(self, func, data=None):
+        self._callback = func
+        self._data = data
+
+    #   Remove input callback
+    def cancel_callback(self):
+        self._callback = None
+
+    #   Close port (does nothing, provided for compatibility with rtmidi)
+    def close_port(self):
+        pass
+
+    #   Discard record of sent data
+    def clear(self):
+        self.sent.clear()
+        self.messages = 0
+
+
+#   Class sending sysex to FCB1010 paced to the MIDI wire rate
+#   Each dump is sent as a single message by default because MIDI APIs such as rtmidi reject messages longer than
+#   3 bytes which do not start with 0xF0. Splitting into packets is only suitable for ports accepting raw bytes.
+#   Input may be paused during transmission and is resumed as soon as the device is ready.
+class fcb1010_transmitter:
+    #   Constructor
+    #   port: MIDI output providing send_message, e.g. rtmidi.MidiOut or fcb1010_loopback_port
+    #   rate: Wire rate in baud or None to send unthrottled, e.g. to virtual ports [Default: 31250]
+    #   packet_size: Bytes per packet for ports accepting raw bytes or None to send each dump as a single message [Default: None]
+    #   settle: Seconds to allow FCB1010 to process dump after last byte is sent [Default: 0.5]
+    #   pause_input: Function called before sending, e.g. midiin.cancel_callback
+    #   resume_input: Function called when device is ready to send
+    #   validate: True to refuse to send configurations with invalid values [Default: True]
+    def __init__(self, port, rate=_MIDI_BAUD, packet_size=None, settle=0.5, pause_input=None, resume_input=None, validate=True):
+        self.port = port
+        self.rate = rate
+        self.packet_size = packet_size
+        self.settle = settle
+        self.pause_input = pause_input
+        self.resume_input = resume_input
+        self.validate = validate
+        self.sent = 0 # Bytes of current dump sent
+        self.busy = False
+        self._lock = None
+
+    #   Send sysex, waiting for any previous send to complete
+    #   config: fcb1010 object or raw sysex data to send
+    #   returns: Quantity of bytes sent, 0 if configuration is invalid
+    async def send(self, config):
+        if isinstance(config, fcb1010):
+            if self.validate:
+                violations = config.validate()
+                if violations:
+                    _print_violations("Invalid configuration not sent:", violations)
+                    return 0
+            data = config.get_raw_sysex()
+            stats = config.stats
+        else:
+            data = bytes(config)
+            stats = fcb1010.stats
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            return await self._send(data, stats)
+
+    #   Start sending sysex in background
+    #   config: fcb1010 object or raw sysex data to send
+    #   returns: asyncio.Task which completes with quantity of bytes sent when device is ready
+    def start(self, config):
+        return asyncio.ensure_future(self.send(config))
+
+    #   Get time to transfer data over MIDI wire
+    #   size: Quantity of bytes
+    #   returns: Duration in seconds (0 if unthrottled)
+    def get_wire_time(self, size):
+        if not self.rate:
+            return 0
+        return size * _MIDI_BITS_PER_BYTE / self.rate
+
+    #   Send data as paced packets
+    #   data: Raw sysex
+    #   stats: fcb1010_stats object to record transfer or None
+    #   returns: Quantity of bytes sent
+    async def _send(self, data, stats=None):
+        loop = asyncio.get_running_loop()
+        size = len(data)
+        packet_size = self.packet_size or size
+        self.busy = True
+        self.sent = 0
+        if self.pause_input:
+            self.pause_input()
+        try:
+            start = loop.time()
+            while self.sent < size:
+                packet = data[self.sent:self.sent + packet_size]
+                self.port.send_message(packet)
+                self.sent += len(packet)
+                if stats is not None:
+                    stats.count('midi_out.bytes', len(packet))
+                    stats.count('midi_out.packets')
+                # Wait until packet would have left the wire
+                await asyncio.sleep(max(0, start + self.get_wire_time(self.sent) - loop.time()))
+            if stats is not None:
+                stats.time('midi_out.send', int((loop.time() - start) * 1e9))
+                stats.count('midi_out.dumps')
+            await asyncio.sleep(self.settle)
+        except BaseException:
+            if 0 < self.sent < size:
+                with contextlib.suppress(Exception):
+                    self.port.send_message(b'\xf7') # Terminate partial sysex
+            raise
+        finally:
+            self.busy = False
+            if self.resume_input:
+                self.resume_input()
+        return self.sent
+
+
+#   Class providing a binary archive of named FCB1010 configurations
+#   File layout (little endian):
+#       Header: magic "FCB1010A", version (uint16), reserved (uint16), quantity of entries (uint32),
+#           offset of index (uint64), 8 reserved bytes
+#       Dumps: 2352 byte raw sysex per entry
+#       Index: per entry name (64 bytes UTF-8, zero padded), timestamp (float64 seconds since epoch),
+#           BLAKE2b hash of dump (16 bytes), offset of dump (uint64)
+#   The file is memory mapped so reading a configuration only touches the pages holding its dump.
+#   New dumps are written after the current index and the header is updated last so an interrupted update leaves
+#   the previous index intact.
+class fcb1010_archive:
+    #   Constructor
+    def __init__(self):
+        self.filename = None
+        self.mode = None
+        self._file = None
+        self._map = None
+        self._view = None
+        self._index = {} # Map of name to (timestamp, hash, offset)
+        self._end = _ARCHIVE_HEADER.size # Offset of first free byte
+        self._mapped_end = self._end # End of index when mapped. Data beyond may be stale in the map
+        self._modified = False
+
+    #   Open archive file
+    #   filename: Absolute or relative path and filename [Default: ./FCB1010.fcba]
+    #   mode: 'r' to read, 'a' to read and add (creating file if necessary), 'w' to create new archive
     #   returns: True on success
-    def save(self, filename='FCB1010.csv'):
+    def open(self, filename='FCB1010.fcba', mode='r'):
+        self.close()
         try:
-            with open(filename, 'w') as file:
-                file.write('Global,,Program Change 1,,Program Change 2,,Program Change 3,,Program Change 4,,Program Change 5,,"Continuous\nController 1",,,"Continuous\nController 2",,,Switch 1,Switch 2,"Expression\nPedal A",,,,"Expression\nPedal B",,,,Note,\n')
-                file.write("MIDI Channel,,%d,,%d,,%d,,%d,,%d,,%d,,,%d,,,N/A,N/A,%d,,,,%d,,,,%d,\n" % (
-                    self.pc1_midi_channel,
-                    self.pc2_midi_channel,
-                    self.pc3_midi_channel,
-                    self.pc4_midi_channel,
-                    self.pc5_midi_channel,
-                    self.cc1_midi_channel,
-                    self.cc2_midi_channel,
-                    self.expA_midi_channel,
-                    self.expB_midi_channel,
-                    self.note_midi_channel))
-                file.write('Bank,Preset,Enabled,Program,Enabled,Program,Enabled,Program,Enabled,Program,Enabled,Program,Enabled,Controller,Value,Enabled,Controller,Value,Enabled,Enabled,Enabled,Controller,Minimum,Maximum,Enabled,Controller,Minimum,Maximum,Enabled,Value\n')
-                for bank in range(10):
-                    for offset in range(10):
-                        preset = (bank - 1) * 10 + offset - 1
-                        file.write("%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d\n" % (
-                        bank, offset,
-                        self.preset[preset].pc1_enabled,
-                        self.preset[preset].pc1_program,
-                        self.preset[preset].pc2_enabled,
-                        self.preset[preset].pc2_program,
-                        self.preset[preset].pc3_enabled,
-                        self.preset[preset].pc3_program,
-                        self.preset[preset].pc4_enabled,
-                        self.preset[preset].pc4_program,
-                        self.preset[preset].pc5_enabled,
-                        self.preset[preset].pc5_program,
-                        self.preset[preset].cc1_enabled,
-                        self.preset[preset].cc1_controller,
-                        self.preset[preset].cc1_value,
-                        self.preset[preset].cc1_enabled,
-                        self.preset[preset].cc1_controller,
-                        self.preset[preset].cc1_value,
-                        self.preset[preset].switch1_enabled,
-                        self.preset[preset].switch2_enabled,
-                        self.preset[preset].expA_enabled,
-                        self.preset[preset].expA_controller,
-                        self.preset[preset].expA_min,
-                        self.preset[preset].expA_max,
-                        self.preset[preset].expB_enabled,
-                        self.preset[preset].expB_controller,
-                        self.preset[preset].expB_min,
-                        self.preset[preset].expB_max,
-                        self.preset[preset].note_enabled,
-                        self.preset[preset].note_value))
-        except:
-            print("Failed to write file", filename)
+            if mode == 'w' or (mode == 'a' and not os.path.exists(filename)):
+                self._file = open(filename, 'w+b')
+                self._file.write(_ARCHIVE_HEADER.pack(_ARCHIVE_MAGIC, _ARCHIVE_VERSION, 0, 0, _ARCHIVE_HEADER.size))
+                self._file.flush()
+            elif mode in ('r', 'a'):
+                self._file = open(filename, 'rb' if mode == 'r' else 'r+b')
+            else:
+                print("Invalid archive mode", mode)
+                return False
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            print("Failed to open archive", filename)
+            self.close()
+            return False
+        self.filename = filename
+        self.mode = mode
+        if not self._read_index():
+            print("Invalid archive", filename)
+            self.close()
             return False
+        if mode == 'a' and len(self._map) > self._end:
+            # Discard dumps written by an update interrupted before its index was written
+            try:
+                self._unmap()
+                self._file.truncate(self._end)
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._map)
+            except (OSError, ValueError):
+                print("Failed to open archive", filename)
+                self.close()
+                return False
         return True
 
+    #   Read index from mapped file
+    #   returns: True if archive is valid
+    def _read_index(self):
+        if len(self._map) < _ARCHIVE_HEADER.size:
+            return False
+        magic, version, reserved, count, offset = _ARCHIVE_HEADER.unpack_from(self._map)
+        if magic != _ARCHIVE_MAGIC or version != _ARCHIVE_VERSION:
+            return False
+        if offset + count * _ARCHIVE_ENTRY.size > len(self._map):
+            return False
+        self._view = memoryview(self._map)
+        self._index = {}
+        for name, timestamp, digest, dump_offset in _ARCHIVE_ENTRY.iter_unpack(self._view[offset:offset + count * _ARCHIVE_ENTRY.size]):
+            if dump_offset + _SYSEX_SIZE > offset:
+                return False
+            self._index[name.rstrip(b'\0').decode('utf-8', 'replace')] = (timestamp, digest, dump_offset)
+        self._end = offset + count * _ARCHIVE_ENTRY.size
+        self._mapped_end = self._end
+        return True
+
+    #   Write pending changes and close archive
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        self._unmap()
+        self._file.close()
+        self._file = None
+        self._index = {}
+        self.filename = None
+        self.mode = None
+
+    #   Release memory map
+    #   Configurations obtained with lazy get which have not yet been accessed keep the mapping alive until released
+    def _unmap(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    #   Get names of archived configurations
+    #   returns: List of names in the order added
+    def names(self):
+        return list(self._index)
+
+    #   Get index entry of a configuration
+    #   name: Name of configuration
+    #   returns: Tuple (timestamp, hash) or None if not found
+    def get_entry(self, name):
+        entry = self._index.get(name)
+        if entry is None:
+            return None
+        return entry[:2]
+
+    #   Get raw sysex of a configuration without copying
+    #   name: Name of configuration
+    #   verify: True to check content against hash
+    #   returns: memoryview of raw sysex or None if not found or verification fails
+    def get_raw(self, name, verify=False):
+        entry = self._index.get(name)
+        if entry is None:
+            return None
+        offset = entry[2]
+        if offset + _SYSEX_SIZE <= self._mapped_end:
+            data = self._view[offset:offset + _SYSEX_SIZE]
+        else:
+            # Added since last flush so not yet mapped
+            try:
+                self._file.flush()
+                self._file.seek(offset)
+                data = memoryview(self._file.read(_SYSEX_SIZE))
+            except OSError:
+                print("Failed to read archive", self.filename)
+                return None
+        if verify and _archive_hash(data) != entry[1]:
+            print("Archive entry corrupt", name)
+            return None
+        return data
+
+    #   Get a configuration
+    #   name: Name of configuration
+    #   lazy: True to decode presets from mapped file when first accessed [Default: True]
+    #   returns: fcb1010 object or None if not found or invalid
+    def get(self, name, lazy=True):
+        data = self.get_raw(name)
+        if data is None:
+            return None
+        config = fcb1010()
+        if not config.parse_sysex(data, lazy):
+            print("Archive entry is not valid FCB1010 sysex", name)
+            return None
+        return config
+
+    #   Add a configuration, replacing any existing configuration with same name
+    #   name: Name of configuration (up to 64 bytes UTF-8)
+    #   config: fcb1010 object or raw sysex data
+    #   timestamp: Time of configuration in seconds since epoch [Default: now]
+    #   returns: True on success
+    def add(self, name, config, timestamp=None):
+        if self.mode not in ('a', 'w'):
+            print("Archive not open for writing")
+            return False
+        if len(name.encode('utf-8')) > _ARCHIVE_NAME_SIZE:
+            print("Archive entry name too long", name)
+            return False
+        data = config.get_raw_sysex() if isinstance(config, fcb1010) else _validate_sysex(config)
+        if data is None:
+            print("Invalid FCB1010 sysex", name)
+            return False
+        try:
+            self._file.seek(self._end)
+            self._file.write(data)
+        except OSError:
+            print("Failed to write archive", self.filename)
+            return False
+        self._index.pop(name, None)
+        self._index[name] = (time.time() if timestamp is None else timestamp, _archive_hash(data), self._end)
+        self._end += _SYSEX_SIZE
+        self._modified = True
+        return True
+
+    #   Write index of added configurations
+    #   returns: True on success
+    def flush(self):
+        if not self._modified:
+            return True
+        index = bytearray()
+        for name, (timestamp, digest, offset) in self._index.items():
+            index += _ARCHIVE_ENTRY.pack(name.encode('utf-8'), timestamp, digest, offset)
+        try:
+            self._file.seek(self._end)
+            self._file.write(index)
+            self._file.flush()
+            self._file.seek(0)
+            self._file.write(_ARCHIVE_HEADER.pack(_ARCHIVE_MAGIC, _ARCHIVE_VERSION, 0, len(self._index), self._end))
+            self._file.flush()
+        except OSError:
+            print("Failed to write archive", self.filename)
+            return False
+        self._modified = False
+        self._end += len(index)
+        self._mapped_end = self._end
+        self._unmap()
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        return True
+
+    #   Rewrite archive without space left by replaced configurations and superseded indices
+    #   Each flush writes a new index after the dumps so frequent flushes leave unused space in the file.
+    #   returns: True on success
+    def compact(self):
+        if self.mode not in ('a', 'w'):
+            print("Archive not open for writing")
+            return False
+        filename = self.filename
+        temporary = filename + '.tmp'
+        try:
+            with open(temporary, 'wb') as file:
+                file.write(bytes(_ARCHIVE_HEADER.size))
+                index = bytearray()
+                offset = _ARCHIVE_HEADER.size
+                for name, (timestamp, digest, dump_offset) in self._index.items():
+                    file.write(self.get_raw(name))
+                    index += _ARCHIVE_ENTRY.pack(name.encode('utf-8'), timestamp, digest, offset)
+                    offset += _SYSEX_SIZE
+                file.write(index)
+                file.seek(0)
+                file.write(_ARCHIVE_HEADER.pack(_ARCHIVE_MAGIC, _ARCHIVE_VERSION, 0, len(self._index), offset))
+            self._modified = False # Pending additions are in the new file
+            self._unmap()
+            self._file.close()
+            self._file = None
+            os.replace(temporary, filename)
+        except (OSError, TypeError):
+            print("Failed to compact archive", filename)
+            with contextlib.suppress(OSError):
+                os.remove(temporary)
+            return False
+        return self.open(filename, 'a')
+
+
+#   Get hash used to identify archived sysex
+#   data: Raw sysex
+#   returns: 16 byte digest
+def _archive_hash(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+#   Class emulating the MIDI output of FCB1010 when presets are selected
+#   The messages sent by each preset are built once from the configuration so that selecting a preset is a table
+#   lookup. Call update after changing the configuration.
+class fcb1010_emulator:
+    #   Constructor
+    #   config: fcb1010 object
+    #   port: MIDI output providing send_message, e.g. rtmidi.MidiOut or fcb1010_loopback_port, or None
+    #   raw: True to send each burst as one byte stream packed with running status (if enabled in configuration),
+    #       False to send each message separately as required by rtmidi [Default: False]
+    #   velocity: Velocity of note on messages [Default: 127]
+    def __init__(self, config, port=None, raw=False, velocity=127):
+        self.config = config
+        self.port = port
+        self.raw = raw
+        self.velocity = velocity
+        self.preset = None # Index of last selected preset
+        self.switch1 = False # State of switch 1 relay
+        self.switch2 = False # State of switch 2 relay
+        self._status = None # Last status byte sent on wire (for running status)
+        self.update()
+
+    #   Build message tables from configuration
+    def update(self):
+        config = self.config
+        columns = config.presets.columns
+        tables = []
+        for index in range(_PRESET_COUNT):
+            messages = []
+            for field, kind, fields in _EMULATOR_MESSAGES:
+                if columns[field][index]:
+                    status = kind | (getattr(config, fields[0]) & 15)
+                    data = [columns[name][index] & 127 for name in fields[1:]]
+                    if kind == 0x90:
+                        data.append(self.velocity & 127)
+                    messages.append(bytes([status] + data))
+            # Pack burst with running status, omitting repeated status bytes
+            packed = bytearray()
+            status = None
+            for message in messages:
+                if config.running_status and message[0] == status:
+                    packed += message[1:]
+                else:
+                    packed += message
+                status = message[0]
+            first = messages[0][0] if messages else None
+            tables.append((tuple(messages), bytes(packed), bytes(packed[1:]), first, status, b''.join(messages)))
+        self._tables = tuple(tables)
+        self._switches = tuple(zip(columns['switch1_enabled'], columns['switch2_enabled']))
+        self._running_status = config.running_status
+        self._status = None
+
+    #   Get messages sent by a preset
+    #   index: Index of preset (0..99)
+    #   returns: Tuple of messages as bytes
+    def get_messages(self, index):
+        return self._tables[index][0]
+
+    #   Select a preset, sending its messages
+    #   index: Index of preset (0..99)
+    #   returns: Bytes sent to port. Only packed with running status in raw mode
+    def select(self, index):
+        messages, packed, stripped, first, last, joined = self._tables[index]
+        self.preset = index
+        self.switch1, self.switch2 = self._switches[index]
+        port = self.port
+        if not self.raw:
+            # Each message is sent in full so running status is not used
+            if port is not None:
+                for message in messages:
+                    port.send_message(message)
+            return joined
+        if self._running_status and first is not None and first == self._status:
+            stream = stripped
+        else:
+            stream = packed
+        if last is not None:
+            self._status = last
+        if port is not None and stream:
+            port.send_message(stream)
+        return stream
+
+    #   Select a preset by bank and foot switch
+    #   bank: Bank index (0..9)
+    #   switch: Foot switch (1..10)
+    #   returns: Bytes sent to port
+    def select_bank_preset(self, bank, switch):
+        return self.select(bank * 10 + switch - 1)
+
+    #   Forget last status byte, e.g. after another device has sent on the same wire
+    def reset_running_status(self):
+        self._status = None
+
+
+#   Class mapping raw expression pedal positions to MIDI continuous controller messages
+#   A lookup table per preset and pedal combines the global pedal calibration with the preset's minimum
+#   and maximum. Output is thinned: values that change by less than the resolution are dropped (except the range
+#   limits) and messages for each pedal are limited to one per interval, the latest value being held until flush.
+class fcb1010_expression:
+    #   Constructor
+    #   config: fcb1010 object
+    #   port: MIDI output providing send_message or None
+    #   resolution: Minimum change of CC value to send [Default: 1]
+    #   interval: Minimum time in seconds between messages from each pedal [Default: 0, no limit]
+    def __init__(self, config, port=None, resolution=1, interval=0):
+        self.config = config
+        self.port = port
+        self.resolution = resolution
+        self.interval = interval
+        self.preset = 0 # Index of selected preset
+        self.update()
+
+    #   Build lookup tables from configuration
+    def update(self):
+        config = self.config
+        columns = config.presets.columns
+        tables = {} # Identical tables are shared
+        self._pedals = []
+        for pedal in ('expA', 'expB'):
+            low = getattr(config, pedal + '_calibration_min')
+            high = getattr(config, pedal + '_calibration_max')
+            status = 0xb0 | (getattr(config, pedal + '_midi_channel') & 15)
+            presets = []
+            for index in range(_PRESET_COUNT):
+                minimum = columns[pedal + '_min'][index] & 127
+                maximum = columns[pedal + '_max'][index] & 127
+                key = (low, high, minimum, maximum)
+                if key not in tables:
+                    tables[key] = _expression_table(low, high, minimum, maximum)
+                presets.append((columns[pedal + '_enabled'][index] == 1, columns[pedal + '_controller'][index] & 127,
+                    tables[key], min(minimum, maximum), max(minimum, maximum)))
+            self._pedals.append((status, tuple(presets)))
+        self._last = [None, None] # Last value sent per pedal
+        self._time = [None, None] # Time of last message per pedal
+        self._pending = [None, None] # Value held back by interval per pedal
+
+    #   Select preset whose mapping is used
+    #   index: Index of preset (0..99)
+    def select(self, index):
+        self.preset = index
+        self._last = [None, None]
+        self._pending = [None, None]
+
+    #   Map a sequence of raw pedal positions without thinning
+    #   pedal: 0 for expression pedal A, 1 for expression pedal B
+    #   positions: bytes-like object of raw positions (0..127)
+    #   returns: bytes of CC values
+    def map(self, pedal, positions):
+        return bytes(positions).translate(self._pedals[pedal][1][self.preset][2])
+
+    #   Process a raw pedal position
+    #   pedal: 0 for expression pedal A, 1 for expression pedal B
+    #   position: Raw position (0..127)
+    #   now: Current time in seconds [Default: time.monotonic()]
+    #   returns: CC message sent as bytes or None if thinned or pedal disabled
+    def process(self, pedal, position, now=None):
+        status, presets = self._pedals[pedal]
+        enabled, controller, table, minimum, maximum = presets[self.preset]
+        if not enabled:
+            return None
+        value = table[position & 127]
+        last = self._last[pedal]
+        if last is not None:
+            if value == last:
+                self._pending[pedal] = None
+                return None
+            if abs(value - last) < self.resolution and value != minimum and value != maximum:
+                self._pending[pedal] = None # Pedal has returned close to last value sent
+                return None
+        if self.interval:
+            if now is None:
+                now = time.monotonic()
+            sent = self._time[pedal]
+            if sent is not None and now - sent < self.interval:
+                self._pending[pedal] = value
+                return None
+            self._time[pedal] = now
+        return self._send(pedal, status, controller, value)
+
+    #   Send values held back by the rate limit once their interval has elapsed
+    #   now: Current time in seconds [Default: time.monotonic()]
+    #   returns: List of CC messages sent
+    def flush(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        sent = []
+        for pedal in (0, 1):
+            value = self._pending[pedal]
+            if value is None or (self._time[pedal] is not None and now - self._time[pedal] < self.interval):
+                continue
+            status, presets = self._pedals[pedal]
+            self._time[pedal] = now
+            sent.append(self._send(pedal, status, presets[self.preset][1], value))
+        return sent
+
+    #   Send CC message
+    #   pedal: 0 for expression pedal A, 1 for expression pedal B
+    #   status: MIDI status byte
+    #   controller: CC number
+    #   value: CC value
+    #   returns: Message as bytes
+    def _send(self, pedal, status, controller, value):
+        self._last[pedal] = value
+        self._pending[pedal] = None
+        message = bytes((status, controller, value))
+        if self.port is not None:
+            self.port.send_message(message)
+        return message
+
+
+#   Build expression pedal lookup table
+#   low: Raw position at heel down (calibration minimum)
+#   high: Raw position at toe down (calibration maximum)
+#   minimum: CC value at heel down
+#   maximum: CC value at toe down
+#   returns: 256 byte table of CC value indexed by raw position (repeated for positions 128..255 to allow translate)
+def _expression_table(low, high, minimum, maximum):
+    if high <= low:
+        low = 0
+        high = 127
+    table = bytearray(128)
+    for position in range(128):
+        fraction = min(1, max(0, (position - low) / (high - low)))
+        table[position] = int(minimum + fraction * (maximum - minimum) + 0.5)
+    return bytes(table) * 2
+
+
+#   Class providing MIDI ports through python-rtmidi
+#   Each FCB1010 is reached through an input and output port of the same name.
+class fcb1010_rtmidi_backend:
+    #   Constructor
+    #   api: rtmidi API, e.g. rtmidi.API_LINUX_ALSA [Default: rtmidi.API_UNSPECIFIED]
+    #   client_name: MIDI client name [Default: fcb1010]
+    def __init__(self, api=None, client_name='fcb1010'):
+        import rtmidi # Only required when using this backend
+        self.rtmidi = rtmidi
+        self.api = rtmidi.API_UNSPECIFIED if api is None else api
+        self.client_name = client_name
+
+    #   Get names of ports available for both input and output
+    #   returns: List of port names
+    def get_ports(self):
+        midi_in = self.rtmidi.MidiIn(self.api, self.client_name)
+        midi_out = self.rtmidi.MidiOut(self.api, self.client_name)
+        outputs = midi_out.get_ports()
+        ports = [name for name in midi_in.get_ports() if name in outputs]
+        midi_in.delete()
+        midi_out.delete()
+        return ports
+
+    #   Open input and output port
+    #   name: Port name
+    #   returns: Tuple (rtmidi.MidiIn, rtmidi.MidiOut) or None if port not found
+    def open(self, name):
+        midi_in = self.rtmidi.MidiIn(self.api, self.client_name)
+        midi_out = self.rtmidi.MidiOut(self.api, self.client_name)
+        inputs = midi_in.get_ports()
+        outputs = midi_out.get_ports()
+        if name not in inputs or name not in outputs:
+            print("MIDI port not found:", name)
+            return None
+        midi_in.open_port(inputs.index(name))
+        midi_out.open_port(outputs.index(name))
+        midi_in.ignore_types(sysex=False) # Enable reception of sysex
+        return (midi_in, midi_out)
+
+
+#   Class providing in-process MIDI ports, e.g. for testing without hardware
+#   Each port is an fcb1010_loopback_port used for both input and output. Send data to a port's send_message to
+#   emulate a board sending a dump.
+class fcb1010_loopback_backend:
+    #   Constructor
+    #   names: Iterable of port names [Default: one port named "FCB1010"]
+    def __init__(self, names=('FCB1010',)):
+        self.ports = {name: fcb1010_loopback_port() for name in names}
+
+    #   Get names of ports
+    #   returns: List of port names
+    def get_ports(self):
+        return list(self.ports)
+
+    #   Open input and output port
+    #   name: Port name
+    #   returns: Tuple (input port, output port) or None if port not found
+    def open(self, name):
+        if name not in self.ports:
+            print("MIDI port not found:", name)
+            return None
+        return (self.ports[name], self.ports[name])
+
+
+#   Class holding the configuration, receiver and transmitter of one FCB1010 connected to a pair of MIDI ports
+class fcb1010_board:
+    #   Constructor
+    #   name: Port name
+    #   midi_in: MIDI input providing set_callback and cancel_callback, e.g. rtmidi.MidiIn
+    #   midi_out: MIDI output providing send_message, e.g. rtmidi.MidiOut
+    #   on_complete: Function called with (board, raw dump) when a dump is received
+    #   options: Keyword arguments passed to fcb1010_transmitter, e.g. rate
+    def __init__(self, name, midi_in, midi_out, on_complete=None, **options):
+        self.name = name
+        self.midi_in = midi_in
+        self.midi_out = midi_out
+        self.config = fcb1010()
+        self.configured = False # True once config holds a received or assigned configuration
+        self.on_complete = on_complete
+        self.receiver = fcb1010_receiver(self.config, on_complete=self._on_complete, parse=False)
+        self.transmitter = fcb1010_transmitter(midi_out, pause_input=self.pause_input, resume_input=self.resume_input, **options)
+        self.waiters = [] # Futures to complete with the next received dump
+        self.resume_input()
+
+    #   Handle dump received by receiver
+    def _on_complete(self, receiver, data):
+        if self.on_complete:
+            self.on_complete(self, data)
+
+    #   Stop handling MIDI input, e.g. to ignore sysex echoed by MIDI thru while sending
+    def pause_input(self):
+        self.midi_in.cancel_callback()
+
+    #   Handle MIDI input
+    def resume_input(self):
+        self.receiver.reset()
+        self.midi_in.set_callback(self.receiver.midi_callback)
+
+    #   Close MIDI ports
+    def close(self):
+        self.midi_in.cancel_callback()
+        self.midi_in.close_port()
+        if self.midi_out is not self.midi_in:
+            self.midi_out.close_port()
+
+
+#   Class managing several FCB1010 each connected to its own pair of MIDI ports
+#   Dumps received on each port populate that board's fcb1010 object. Dumps may be collected from and sent to many
+#   boards concurrently. MIDI backends may call input callbacks from their own threads so received dumps are parsed
+#   within the asyncio event loop when one is running.
+class fcb1010_manager:
+    #   Constructor
+    #   backend: MIDI backend providing get_ports and open, e.g. fcb1010_rtmidi_backend or fcb1010_loopback_backend
+    #   on_dump: Function called with (board) when a dump is received and parsed into board.config
+    #   lazy: True to decode each preset of received dumps when first accessed
+    #   options: Keyword arguments passed to each fcb1010_transmitter, e.g. rate, settle
+    def __init__(self, backend, on_dump=None, lazy=False, **options):
+        self.backend = backend
+        self.on_dump = on_dump
+        self.lazy = lazy
+        self.options = options
+        self.boards = {} # Map of port name to fcb1010_board
+        self._loop = None
+
+    #   Open ports
+    #   names: Iterable of port names [Default: All ports provided by backend]
+    #   returns: List of names of boards opened
+    def open(self, names=None):
+        if names is None:
+            names = self.backend.get_ports()
+        opened = []
+        for name in names:
+            if name in self.boards:
+                continue
+            ports = self.backend.open(name)
+            if ports is None:
+                continue
+            self.boards[name] = fcb1010_board(name, ports[0], ports[1], self._on_complete, **self.options)
+            opened.append(name)
+        return opened
+
+    #   Close ports
+    #   names: Iterable of port names [Default: All boards]
+    def close(self, names=None):
+        for name in list(self.boards if names is None else names):
+            board = self.boards.pop(name, None)
+            if board:
+                board.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.boards)
+
+    def __contains__(self, name):
+        return name in self.boards
+
+    #   Get configuration of a board
+    #   name: Port name
+    #   returns: fcb1010 object holding last received (or sent) configuration
+    def __getitem__(self, name):
+        return self.boards[name].config
+
+    #   Assign configuration of a board, e.g. to restore from an archive with send_all
+    #   name: Port name
+    #   config: fcb1010 object or raw sysex
+    #   returns: True on success
+    def set_config(self, name, config):
+        board = self.boards[name]
+        if config is not board.config:
+            data = config.get_raw_sysex() if isinstance(config, fcb1010) else config
+            if not board.config.parse_sysex(data):
+                return False
+        board.configured = True
+        return True
+
+    #   Handle dump received by a board (called from MIDI backend thread)
+    #   board: fcb1010_board which received dump
+    #   data: Raw dump
+    def _on_complete(self, board, data):
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self._on_dump, board, data)
+                return
+            except RuntimeError:
+                pass # Loop closed since check
+        self._on_dump(board, data)
+
+    #   Parse received dump into board's configuration and notify waiters
+    #   board: fcb1010_board which received dump
+    #   data: Raw dump
+    def _on_dump(self, board, data):
+        board.config.parse_sysex(data, self.lazy)
+        board.configured = True
+        waiters = board.waiters
+        board.waiters = []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(board.config)
+        if self.on_dump:
+            self.on_dump(board)
+
+    #   Wait for each board to send a dump, e.g. when triggered from each board's global configuration menu
+    #   names: Iterable of port names [Default: All boards]
+    #   timeout: Maximum seconds to wait or None to wait indefinitely
+    #   returns: Dictionary of port name: fcb1010 object or None if no dump received within timeout
+    async def receive_all(self, names=None, timeout=None):
+        self._loop = asyncio.get_running_loop()
+        names = list(self.boards if names is None else names)
+        waiters = {}
+        for name in names:
+            waiter = self._loop.create_future()
+            self.boards[name].waiters.append(waiter)
+            waiters[name] = waiter
+        if waiters:
+            await asyncio.wait(waiters.values(), timeout=timeout)
+        results = {}
+        for name, waiter in waiters.items():
+            if waiter.done():
+                results[name] = waiter.result()
+            else:
+                waiter.cancel()
+                self.boards[name].waiters.remove(waiter)
+                results[name] = None
+        return results
+
+    #   Send configurations to boards concurrently. Each board's configuration is updated with the one sent
+    #   configs: Dictionary of port name: fcb1010 object or raw sysex [Default: Configuration of each board which has
+    #       received a dump or been assigned a configuration. Other boards are skipped to avoid resetting them to defaults]
+    #   returns: Dictionary of port name: quantity of bytes sent (0 if configuration invalid or board skipped)
+    async def send_all(self, configs=None):
+        self._loop = asyncio.get_running_loop()
+        results = {}
+        if configs is None:
+            configs = {}
+            for name, board in self.boards.items():
+                if board.configured:
+                    configs[name] = board.config
+                else:
+                    print("No configuration received or assigned for board", name)
+                    results[name] = 0
+        names = list(configs)
+        counts = await asyncio.gather(*(self.boards[name].transmitter.send(configs[name]) for name in names))
+        for name, count in zip(names, counts):
+            if count:
+                self.set_config(name, configs[name])
+            results[name] = count
+        return results
+
+    #   Receive a dump from each board and store in archive
+    #   archive: fcb1010_archive opened for writing
+    #   prefix: Text prepended to each port name to form archive entry name, e.g. date of show
+    #   names: Iterable of port names [Default: All boards]
+    #   timeout: Maximum seconds to wait for dumps or None to wait indefinitely
+    #   returns: List of port names of boards which did not send a dump within timeout or could not be stored
+    async def backup(self, archive, prefix='', names=None, timeout=None):
+        missing = []
+        for name, config in (await self.receive_all(names, timeout)).items():
+            if config is None or not archive.add(prefix + name, config):
+                missing.append(name)
+        return missing
+
+
+#   Batch processing of configuration files
+#   Each file is processed in a separate job within a process pool so that a malformed file only fails its own job.
+
+_BATCH_EXTENSIONS = ('.csv', '.syx')
+
+
+#   Find configuration files
+#   paths: Iterable of files and directories. Directories are searched recursively for .csv and .syx files
+#   returns: Iterator of (file path, path relative to its search root)
+def _find_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, folders, files in os.walk(path):
+                folders.sort()
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in _BATCH_EXTENSIONS:
+                        file = os.path.join(folder, name)
+                        yield (file, os.path.relpath(file, path))
+        else:
+            yield (path, os.path.basename(path))
+
+
+#   Get file written by a batch job
+#   command: 'convert' or 'normalize'
+#   source: Path of file to process
+#   destination: Path of file to write without extension or None to overwrite source
+#   to: Format to convert to ('csv' or 'syx')
+#   returns: Tuple (destination without extension, format written)
+def _batch_output(command, source, destination, to):
+    if command == 'normalize':
+        to = os.path.splitext(source)[1].lower()[1:]
+    if destination is None:
+        destination = os.path.splitext(source)[0]
+    return (destination, to)
+
+
+#   Process one configuration file
+#   command: 'validate', 'convert' or 'normalize'
+#   source: Path of file to process
+#   destination: Path of file to write without extension or None to overwrite source
+#   to: Format to convert to ('csv' or 'syx')
+#   repair: True to clamp invalid values to their valid range before writing
+#   returns: Description of result
+#   raises: ValueError if file is not valid
+def _batch_file(command, source, destination, to, repair=False):
+    extension = os.path.splitext(source)[1].lower()
+    if extension == '.syx':
+        configs = fcb1010.load_syx_all(source)
+        if not configs:
+            raise ValueError("No FCB1010 sysex found")
+    elif extension == '.csv':
+        config = fcb1010()
+        if not config.load(source):
+            raise ValueError("Invalid CSV")
+        configs = [config]
+    else:
+        raise ValueError("Unsupported file type")
+    repaired = 0
+    for index, config in enumerate(configs):
+        violations = config.validate(repair and command != 'validate')
+        if violations and not (repair and command != 'validate'):
+            details = '; '.join("bank %s preset %s %s = %r: %s" % violation for violation in violations[:5])
+            raise ValueError("Configuration %d has %d invalid values: %s" % (index + 1, len(violations), details))
+        repaired += len(violations)
+    if command == 'validate':
+        return "%d configuration%s" % (len(configs), '' if len(configs) == 1 else 's')
+    destination, to = _batch_output(command, source, destination, to)
+    folder = os.path.dirname(destination)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    if to == 'syx':
+        files = [destination + '.syx']
+        if not fcb1010.save_syx_all(configs, files[0]):
+            raise ValueError("Failed to write " + files[0])
+    else:
+        files = [destination + '.csv'] if len(configs) == 1 else ['%s_%d.csv' % (destination, index + 1) for index in range(len(configs))]
+        for config, file in zip(configs, files):
+            if not config.save(file):
+                raise ValueError("Failed to write " + file)
+    if repaired:
+        return "repaired %d values, wrote %s" % (repaired, ', '.join(files))
+    return "wrote " + ', '.join(files)
+
+
+#   Run one batch job, capturing any output and errors
+#   job: Tuple (command, source, destination, to, repair)
+#   returns: Tuple (source, success, message)
+def _batch_job(job):
+    command, source, destination, to, repair = job
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            message = _batch_file(command, source, destination, to, repair)
+        success = True
+    except Exception as e:
+        message = str(e) or type(e).__name__
+        success = False
+    details = ' '.join(output.getvalue().split())
+    if details:
+        message += " (" + details + ")"
+    return (source, success, message)
+
+
+#   Command line interface
+#   argv: List of arguments [Default: sys.argv]
+#   returns: Exit status, 0 if all files processed successfully
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='fcb1010', description="Validate, convert and normalize FCB1010 configuration files (.csv, .syx)")
+    parser.add_argument('command', choices=('validate', 'convert', 'normalize'),
+        help="validate: check files can be loaded and hold valid values, convert: write in other format, normalize: rewrite in same format")
+    parser.add_argument('paths', nargs='+', help="Files or directories to process recursively")
+    parser.add_argument('--to', choices=('csv', 'syx'), default='syx', help="Format to convert to [Default: syx]")
+    parser.add_argument('--output', help="Directory to write files, mirroring source tree [Default: Beside source]")
+    parser.add_argument('--jobs', type=int, default=None, help="Quantity of worker processes [Default: CPU count]")
+    parser.add_argument('--repair', action='store_true', help="Clamp invalid values to their valid range when converting or normalizing")
+    parser.add_argument('--quiet', action='store_true', help="Only report failures")
+    args = parser.parse_args(argv)
+
+    jobs = []
+    for source, relative in _find_files(args.paths):
+        destination = None
+        if args.output:
+            destination = os.path.join(args.output, os.path.splitext(relative)[0])
+        elif args.command == 'convert':
+            destination = os.path.splitext(source)[0]
+        jobs.append((args.command, source, destination, args.to, args.repair))
+
+    # Refuse jobs which would overwrite another job's output or another source, e.g. song.csv and song.syx
+    results = []
+    if args.command != 'validate':
+        sources = {os.path.normcase(os.path.abspath(job[1])) for job in jobs}
+        outputs = {}
+        checked = []
+        for job in jobs:
+            destination, to = _batch_output(*job[:4])
+            output = os.path.normcase(os.path.abspath(destination + '.' + to))
+            if output in outputs:
+                results.append((job[1], False, "Output %s.%s also written for %s" % (destination, to, outputs[output])))
+            elif output in sources and output != os.path.normcase(os.path.abspath(job[1])):
+                results.append((job[1], False, "Output %s.%s would overwrite a source file" % (destination, to)))
+            else:
+                outputs[output] = job[1]
+                checked.append(job)
+        jobs = checked
+
+    processed = 0
+    failed = 0
+    with multiprocessing.Pool(args.jobs) as pool:
+        for source, success, message in itertools.chain(results, pool.imap_unordered(_batch_job, jobs, chunksize=8)):
+            processed += 1
+            if not success:
+                failed += 1
+                print("FAIL", source, message, flush=True)
+            elif not args.quiet:
+                print("OK  ", source, message, flush=True)
+    print("%d files processed, %d failed" % (processed, failed))
+    return 1 if failed else 0
+
 
 """    
 ## Example usage ##
@@ -485,3 +2533,7 @@ if len(result) > 0 and result.lower[0] != 'n':
     fcb_tx.load()
     send_sysex(fcb_tx)
 """
+
+
+if __name__ == '__main__':
+    sys.exit(main())